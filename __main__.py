@@ -22,8 +22,13 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-import glue
 import sys
+import daemon
 
 if __name__ == '__main__':
-	glue.main(sys.argv)
+	# a running daemon answers before the rest of glue is even imported
+	code = daemon.forward(sys.argv)
+	if code is not None:
+		sys.exit(code)
+	import glue
+	glue.run(sys.argv)
@@ -0,0 +1,67 @@
+#!/bin/sh
+
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+
+# Usage: benchmark.sh [project directory] (current directory by default)
+#
+# Compares the startup time of the source executable and of the bytecode one
+# (see build.sh --bytecode), averaged over $RUNS runs (20 by default) of
+# 'glue buildversion -0' in the given project. The daemon is bypassed.
+
+RUNS=${RUNS:-20}
+PROJECT=${1:-.}
+PYTHON=${PYTHON:-python3}
+export GLUE_NO_DAEMON=1
+
+# built aside, bin/glue is left alone
+export BIN_DIR=$(mktemp -d) || exit 1
+trap 'rm -fr "$BIN_DIR"' EXIT
+sh build.sh > /dev/null || exit 1
+mv "$BIN_DIR/glue" "$BIN_DIR/glue-source"
+sh build.sh --bytecode > /dev/null || exit 1
+mv "$BIN_DIR/glue" "$BIN_DIR/glue-bytecode"
+
+# nanoseconds, 'date +%N' isn't portable (macOS)
+now() {
+	$PYTHON -c 'import time; print(time.monotonic_ns())'
+}
+
+# prints the average duration of a run in milliseconds
+measure() {
+	(cd "$PROJECT" && "$1" buildversion -0 > /dev/null) || exit 1
+	start=$(now)
+	i=0
+	while [ $i -lt $RUNS ]; do
+		(cd "$PROJECT" && "$1" buildversion -0 > /dev/null)
+		i=$((i + 1))
+	done
+	end=$(now)
+	echo $(( (end - start) / RUNS / 1000000 ))
+}
+
+SOURCE=$(measure "$BIN_DIR/glue-source") || exit 1
+BYTECODE=$(measure "$BIN_DIR/glue-bytecode") || exit 1
+echo "glue buildversion -0, average of $RUNS runs:"
+echo "	source:   ${SOURCE}ms"
+echo "	bytecode: ${BYTECODE}ms"
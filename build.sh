@@ -24,19 +24,46 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+# Usage: build.sh [--bytecode]
+#
+# --bytecode ships compiled modules instead of sources: zipimport can't write
+# .pyc files, so a source executable recompiles everything on each run. The
+# bytecode only works with the interpreter version it was compiled by, $PYTHON
+# (python3 by default): the executable runs with that very interpreter.
+#
+# The executable is written to $BIN_DIR/glue (bin/glue by default).
+
 BUILD_DIR=build
 ZIP_FILE=glue.zip
-BIN_DIR=bin
+BIN_DIR=${BIN_DIR:-bin}
 BIN_FILE=$BIN_DIR/glue
+PYTHON=${PYTHON:-python3}
+
+BYTECODE=0
+if [ "$1" = "--bytecode" ]; then
+	BYTECODE=1
+fi
 
 rm -fr $BUILD_DIR
 mkdir $BUILD_DIR
 cp -R hjson $BUILD_DIR/
 cp *.py $BUILD_DIR/
 cd $BUILD_DIR
+find . -name __pycache__ -prune -exec rm -fr {} \;
+if [ $BYTECODE -eq 1 ]; then
+	# legacy layout (module.pyc where module.py was), the one zipimport looks for
+	$PYTHON -m compileall -q -b . || exit 1
+	find . -name '*.py' -exec rm {} \;
+	find . -name __pycache__ -prune -exec rm -fr {} \;
+fi
 zip -r ../$ZIP_FILE *
 cd -
 mkdir -p $BIN_DIR
-echo '#!/usr/bin/python' | cat - $ZIP_FILE > $BIN_FILE
+if [ $BYTECODE -eq 1 ]; then
+	INTERPRETER=$($PYTHON -c 'import sys; print(sys.executable)') || exit 1
+else
+	INTERPRETER="/usr/bin/env python3"
+fi
+echo "#!$INTERPRETER" | cat - $ZIP_FILE > $BIN_FILE
 chmod +x $BIN_FILE
 rm -fr $BUILD_DIR $ZIP_FILE
\ No newline at end of file
@@ -0,0 +1,175 @@
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import atexit
+import datetime
+import logging
+import os
+import subprocess
+import threading
+
+from common import *
+
+# Commit metadata, as read from a raw commit object.
+class Commit:
+	def __init__(self, revision, tree, parents, committer, timestamp, offset, message):
+		self.revision = revision
+		self.tree = tree
+		self.parents = parents
+		self.committer = committer
+		self.timestamp = timestamp
+		self.offset = offset # "+0200" style
+		self.message = message
+	def getDate(self):
+		# same format as git log's '%ci'
+		sign = -1 if self.offset[0] == '-' else 1
+		minutes = sign * (int(self.offset[1:3]) * 60 + int(self.offset[3:5]))
+		tz = datetime.timezone(datetime.timedelta(minutes=minutes))
+		date = datetime.datetime.fromtimestamp(self.timestamp, tz)
+		return date.strftime("%Y-%m-%d %H:%M:%S ") + self.offset
+
+	@staticmethod
+	def parse(revision, data):
+		header, _, message = data.decode("utf-8", "replace").partition("\n\n")
+		tree = None
+		parents = []
+		committer = None
+		timestamp = 0
+		offset = "+0000"
+		for line in header.split("\n"):
+			key, _, value = line.partition(" ")
+			if key == "tree":
+				tree = value
+			elif key == "parent":
+				parents.append(value)
+			elif key == "committer":
+				# "Name <email> 1561479048 +0200"
+				ident, timestamp, offset = value.rsplit(" ", 2)
+				committer = ident
+				timestamp = int(timestamp)
+		return Commit(revision, tree, parents, committer, timestamp, offset, message)
+
+# Long-lived 'git cat-file' process, answering object queries over its pipes.
+# There is at most one per repository (see forRepository), started on first
+# use and stopped when glue exits. Uses --batch-command when git supports it
+# (2.36+), plain --batch otherwise.
+class CatFile:
+	processes = {}
+	processesLock = threading.Lock()
+	batchCommand = None
+
+	def __init__(self, executable, path):
+		self.executable = executable
+		self.path = path
+		self.process = None
+		self.lock = threading.Lock()
+
+	@classmethod
+	def forRepository(cls, executable, path):
+		key = os.path.realpath(path)
+		with cls.processesLock:
+			catfile = cls.processes.get(key)
+			if catfile is None:
+				catfile = CatFile(executable, path)
+				cls.processes[key] = catfile
+			return catfile
+
+	@classmethod
+	def closeAll(cls):
+		with cls.processesLock:
+			for catfile in cls.processes.values():
+				catfile.close()
+			cls.processes = {}
+
+	@classmethod
+	def supportsBatchCommand(cls, executable):
+		if cls.batchCommand is None:
+			out = subprocess.run([executable, "version"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode()
+			# "git version 2.39.5 (Apple Git-154)"
+			try:
+				version = tuple(int(v) for v in out.split()[2].split(".")[0:2])
+			except (IndexError, ValueError):
+				version = (0, 0)
+			cls.batchCommand = version >= (2, 36)
+		return cls.batchCommand
+
+	def start(self):
+		mode = "--batch-command" if CatFile.supportsBatchCommand(self.executable) else "--batch"
+		logging.debug("starting cat-file %s in %s" % (mode, self.path))
+		self.process = subprocess.Popen([self.executable, "cat-file", mode], cwd=self.path, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+		self.batchCommand = mode == "--batch-command"
+
+	def close(self):
+		if self.process is None:
+			return
+		try:
+			self.process.stdin.close()
+			self.process.wait()
+		except (OSError, ValueError):
+			self.process.kill()
+		self.process = None
+
+	def request(self, command, object):
+		# returns (revision, type, contents or size), or None when object can't be found.
+		if "\n" in object:
+			raiseError("Invalid object name '%s'" % object)
+		with self.lock:
+			if self.process is None:
+				self.start()
+			if self.batchCommand:
+				line = "%s %s\n" % (command, object)
+			else:
+				line = object + "\n"
+			try:
+				self.process.stdin.write(line.encode())
+				self.process.stdin.flush()
+				header = self.process.stdout.readline().decode().split()
+			except (OSError, ValueError):
+				header = []
+			if len(header) == 0:
+				self.close()
+				raiseError("git cat-file stopped unexpectedly in %s" % self.path)
+			if len(header) != 3:
+				# "<object> missing" or "<object> ambiguous"
+				return None
+			revision, type, size = header[0], header[1], int(header[2])
+			if command == "info" and self.batchCommand:
+				return (revision, type, size)
+			data = self.process.stdout.read(size + 1)[:-1]
+			if command == "info":
+				return (revision, type, size)
+			return (revision, type, data)
+
+	def resolve(self, revision):
+		info = self.request("info", revision)
+		return info[0] if info is not None else None
+	def exists(self, object):
+		return self.request("info", object) is not None
+	def getCommit(self, revision):
+		object = self.request("contents", revision + "^{commit}")
+		if object is None:
+			return None
+		return Commit.parse(object[0], object[2])
+
+atexit.register(CatFile.closeAll)
@@ -0,0 +1,72 @@
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import collections
+import hashlib
+import json
+import logging
+import os
+
+from statuscache import writeAtomically
+
+CONFIG_CACHE_DIRNAME = "config"
+
+# Parsed configuration files (.gluedeps, .gluestates), stored as JSON so that
+# the (pure Python) hjson decoder only runs when a file changed. Plain data
+# only: entries live in the project tree, loading them must not run code.
+# Entries are keyed by the file's path, size, modification time and content
+# hash, and written atomically: concurrent glue processes can share them.
+class ConfigCache:
+	def __init__(self, directory):
+		self.directory = os.path.join(directory, CONFIG_CACHE_DIRNAME)
+
+	def entryPath(self, path):
+		key = hashlib.sha1(os.path.realpath(path).encode()).hexdigest()
+		return os.path.join(self.directory, key + ".json")
+
+	def readEntry(self, path):
+		try:
+			with open(self.entryPath(path), "r") as f:
+				# same mapping type as hjson
+				return json.load(f, object_pairs_hook=collections.OrderedDict)
+		except (IOError, OSError, ValueError):
+			return None
+
+	# parse(text) result for the file at path, cached
+	def load(self, path, parse):
+		with open(path, "rb") as f:
+			st = os.fstat(f.fileno())
+			content = f.read()
+		key = [os.path.realpath(path), st.st_size, st.st_mtime_ns, hashlib.sha1(content).hexdigest()]
+		entry = self.readEntry(path)
+		if isinstance(entry, dict) and entry.get("key") == key:
+			return entry["value"]
+		logging.debug("config cache: parsing %s" % path)
+		value = parse(content.decode("utf-8"))
+		try:
+			writeAtomically(self.entryPath(path), json.dumps({"key": key, "value": value}))
+		except (IOError, OSError, TypeError, ValueError) as e:
+			logging.warning("Could not write config cache for %s: %s" % (path, e))
+		return value
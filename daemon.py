@@ -0,0 +1,253 @@
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import hashlib
+import json
+import logging
+import os
+import socket
+import stat
+import sys
+import tempfile
+import traceback
+
+from common import *
+
+# Kept light (standard library & common only): the client side runs before the
+# rest of glue is imported (see __main__.py).
+
+DAEMON_DIR_ENV = "GLUE_DAEMON_DIR"
+NO_DAEMON_ENV = "GLUE_NO_DAEMON"
+COMMAND_DAEMON = "daemon"
+# never forwarded: the daemon itself, and commands that don't end
+IN_PROCESS_COMMANDS = (COMMAND_DAEMON, "watch")
+
+def socketDirectory():
+	if os.environ.get(DAEMON_DIR_ENV):
+		return os.environ[DAEMON_DIR_ENV]
+	# private to the user by definition, when there's one
+	if os.environ.get("XDG_RUNTIME_DIR"):
+		return os.path.join(os.environ["XDG_RUNTIME_DIR"], "glue")
+	return os.path.join(tempfile.gettempdir(), "glue-%d" % os.getuid())
+
+def socketPath(root):
+	# hashed: unix socket paths are limited to about 100 characters
+	key = hashlib.sha1(os.path.realpath(root).encode()).hexdigest()[:16]
+	return os.path.join(socketDirectory(), key + ".sock")
+
+# Anyone able to write in the socket directory could stand in for the daemon
+# (and make any command succeed): it must be a real directory of ours, closed
+# to others. Returns why it isn't, None when fine.
+def socketDirectoryProblem(directory):
+	try:
+		st = os.lstat(directory)
+	except OSError as e:
+		return str(e)
+	if not stat.S_ISDIR(st.st_mode):
+		return "%s isn't a directory" % directory
+	if st.st_uid != os.getuid():
+		return "%s belongs to another user" % directory
+	if st.st_mode & 0o077:
+		return "%s is accessible to other users" % directory
+	return None
+
+def connect(root):
+	path = socketPath(root)
+	if not os.path.exists(path):
+		return None
+	problem = socketDirectoryProblem(os.path.dirname(path))
+	if problem is not None:
+		logging.warning("Ignoring glue daemon socket: %s" % problem)
+		return None
+	connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		connection.connect(path)
+	except OSError:
+		# stale socket, daemon gone
+		connection.close()
+		return None
+	return connection
+
+def sendMessage(connection, message):
+	connection.sendall((json.dumps(message) + "\n").encode())
+
+# Runs argv in the daemon of the project at root, relaying its output. Returns
+# the exit code, or None when there's no daemon to talk to.
+def forward(argv, root="."):
+	if os.environ.get(NO_DAEMON_ENV) or any(command in argv[1:] for command in IN_PROCESS_COMMANDS):
+		return None
+	connection = connect(root)
+	if connection is None:
+		return None
+	with connection:
+		sendMessage(connection, {"argv": argv, "tty": sys.stdout.isatty()})
+		for line in connection.makefile("r", encoding="utf-8"):
+			message = json.loads(line)
+			if "out" in message:
+				sys.stdout.write(message["out"])
+				sys.stdout.flush()
+			elif "err" in message:
+				sys.stderr.write(message["err"])
+				sys.stderr.flush()
+			elif "exit" in message:
+				return message["exit"]
+	# not rerun in-process: the command may have been half done
+	sys.stderr.write("Lost connection to the glue daemon\n")
+	return 1
+
+def stop(root="."):
+	connection = connect(root)
+	if connection is None:
+		return False
+	with connection:
+		sendMessage(connection, {"stop": True})
+		connection.makefile("r").readline()
+	return True
+
+# stdout / stderr of a request, sent to the client as they're written
+class RequestStream:
+	def __init__(self, connection, channel, tty):
+		self.connection = connection
+		self.channel = channel
+		self.tty = tty
+	def write(self, text):
+		if text:
+			sendMessage(self.connection, {self.channel: text})
+		return len(text)
+	def flush(self):
+		pass
+	def isatty(self):
+		return self.tty
+
+# log records go to the stderr of the current request
+class CurrentStderrHandler(logging.StreamHandler):
+	def __init__(self):
+		logging.Handler.__init__(self)
+	@property
+	def stream(self):
+		return sys.stderr
+
+# Resident process serving the glue commands of one project root over a unix
+# socket, one at a time. The project (reloaded when its deps file changes) and
+# everything hanging off it stay warm between requests: parsed configuration,
+# repository handles, persistent cat-file & hg processes, and the queries that
+# only depend on full revisions. Anything else about working copies is queried
+# again on every request (see prepare).
+#
+# run(argv, projectFor) executes a command line, projectFor(jobs) returns the
+# project to use. prepare() runs before each command, returning True drops the
+# loaded projects.
+class Daemon:
+	def __init__(self, root, run, projectFactory, configPath, prepare=None):
+		self.root = os.path.realpath(root)
+		self.run = run
+		self.projectFactory = projectFactory
+		self.configPath = configPath
+		self.prepare = prepare
+		self.projects = {} # jobs -> (config signature, project)
+
+	def configSignature(self):
+		try:
+			st = os.stat(self.configPath)
+		except OSError:
+			return None
+		return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+	def projectFor(self, jobs):
+		signature = self.configSignature()
+		cached = self.projects.get(jobs)
+		if cached is None or cached[0] != signature:
+			logging.debug("daemon: loading project (jobs: %s)" % jobs)
+			cached = (signature, self.projectFactory(jobs))
+			self.projects[jobs] = cached
+		return cached[1]
+
+	def execute(self, argv, tty, connection):
+		streams = (sys.stdout, sys.stderr)
+		sys.stdout = RequestStream(connection, "out", tty)
+		sys.stderr = RequestStream(connection, "err", tty)
+		try:
+			if self.prepare is not None and self.prepare():
+				self.projects = {}
+			self.run(argv, self.projectFor)
+			return 0
+		except SystemExit as e:
+			if e.code is None:
+				return 0
+			if isinstance(e.code, int):
+				return e.code
+			sys.stderr.write("%s\n" % e.code)
+			return 1
+		except Exception:
+			sys.stderr.write(traceback.format_exc())
+			return 1
+		finally:
+			(sys.stdout, sys.stderr) = streams
+
+	# returns False when asked to stop
+	def handle(self, connection):
+		request = json.loads(connection.makefile("r", encoding="utf-8").readline() or "{}")
+		if request.get("stop"):
+			sendMessage(connection, {"exit": 0})
+			return False
+		if "argv" in request:
+			code = self.execute(request["argv"], request.get("tty", False), connection)
+			sendMessage(connection, {"exit": code})
+		return True
+
+	def serve(self):
+		path = socketPath(self.root)
+		os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+		problem = socketDirectoryProblem(os.path.dirname(path))
+		if problem is not None:
+			raiseError("Refusing to serve from an unsafe socket directory: %s" % problem)
+		live = connect(self.root)
+		if live is not None:
+			live.close()
+			raiseError("A glue daemon is already running for %s" % self.root)
+		if os.path.exists(path):
+			os.unlink(path)
+		root = logging.getLogger()
+		handler = CurrentStderrHandler()
+		if root.handlers:
+			handler.setFormatter(root.handlers[0].formatter)
+		root.handlers = [handler]
+		server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		server.bind(path)
+		server.listen()
+		logging.info("glue daemon serving %s on %s" % (self.root, path))
+		try:
+			serving = True
+			while serving:
+				(connection, address) = server.accept()
+				with connection:
+					try:
+						serving = self.handle(connection)
+					except (OSError, ValueError) as e:
+						# client gone or garbage, next one
+						logging.warning("daemon: dropped request: %s" % e)
+		finally:
+			server.close()
+			os.unlink(path)
@@ -22,6 +22,8 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import os
+
 from interface import *
 
 
@@ -29,12 +31,28 @@ STATE_REVISION = "revision"
 STATE_METADATE = "date"
 # STATE_METABRANCH = "branch"
 
+# Distances between the recorded revision, HEAD and the upstream head of a
+# dependency. Each distance is a (commits only in the first, commits only in
+# the second) pair, None when one of the revisions is unknown or missing.
+class Drift:
+	def __init__(self, recorded, head, upstream, headFromRecorded=None, upstreamFromHead=None, upstreamFromRecorded=None):
+		self.recorded = recorded
+		self.head = head
+		self.upstream = upstream
+		self.headFromRecorded = headFromRecorded
+		self.upstreamFromHead = upstreamFromHead
+		self.upstreamFromRecorded = upstreamFromRecorded
+	def toDict(self):
+		return dict(vars(self))
+
 # Dependencies of the main project
 class Dependency:
 	KEY_PATH='path'
 	KEY_TYPE='type'
 	KEY_BRANCH='branch'
 	KEY_URL='url'
+	# optional: directories to check out (sparse checkout), everything when missing
+	KEY_PATHS='paths'
 
 	REQUIRED_KEYS=[KEY_PATH, KEY_TYPE, KEY_BRANCH, KEY_URL]
 
@@ -56,18 +74,30 @@ class Dependency:
 		self.type = dict[Dependency.KEY_TYPE]
 		self.branch = dict[Dependency.KEY_BRANCH]
 		self.url = dict[Dependency.KEY_URL]
+		self.paths = dict.get(Dependency.KEY_PATHS)
+		if self.paths is not None and (not isinstance(self.paths, list) or not all(isinstance(p, str) and p.strip("/") for p in self.paths)):
+			raise Exception("'%s' must be a list of directories" % Dependency.KEY_PATHS)
 
 		type = self.type
 		interface = None
 		if type == 'git':
-			interface = GitInterface(self.path, self.url)
+			interface = GitInterface(self.path, self.url, self.paths)
 		elif type == 'hg':
-			interface = MercurialInterface(self.path, self.url)
+			interface = MercurialInterface(self.path, self.url, self.paths)
 		self.interface = interface
 	def __repr__(self):
 		return '%s: path="%s" type=%s url="%s"' % (self.name, self.path, self.type, self.url)
-	def fetch(self):
-		self.interface.fetch()
+	# canonical working copy (symlinks resolved), shared by aliases of the same checkout
+	def realPath(self):
+		return self.interface.repositoryKey()
+	# canonical repository storage (git common dir), shared by worktrees too
+	def storageKey(self):
+		return self.interface.storageKey()
+	# fetches the declared branch only, plus revisions that aren't available locally
+	def fetch(self, revisions=()):
+		self.interface.fetch(self.branch, revisions)
+	def hasRevision(self, revision):
+		return self.interface.hasRevision(revision)
 	def hasUncommittedChanges(self):
 		return self.interface.hasUncommittedChanges()
 	def getRemoteChanges(self):
@@ -76,13 +106,46 @@ class Dependency:
 		return self.interface.getRevision()
 	def getCurrentBranch(self):
 		return self.interface.getCurrentBranch()
-	def getState(self):
+	def getSnapshot(self):
+		return self.interface.getSnapshot()
+	def getState(self, snapshot=None):
+		if snapshot is None:
+			snapshot = self.getSnapshot()
 		state = {}
-		state[STATE_REVISION] = self.getRevision()
-		state[STATE_METADATE] = self.interface.getDate()
+		state[STATE_REVISION] = snapshot.revision
+		state[STATE_METADATE] = snapshot.date
 		# not storing branch, misleading.
 		#state[STATE_METABRANCH] = self.interface.getCurrentBranch()
 		return state
-	def update(self, state):
+	def getDrift(self, state=None):
+		recorded = state[STATE_REVISION] if state is not None else None
+		if recorded is not None and not self.hasRevision(recorded):
+			recorded = None
+		head = self.getRevision()
+		upstream = self.interface.getUpstreamRevision(self.branch)
+		def distance(revision, base):
+			return self.interface.getDistance(revision, base) if revision is not None and base is not None else None
+		return Drift(state[STATE_REVISION] if state is not None else None, head, upstream,
+			distance(head, recorded), distance(upstream, head), distance(upstream, recorded))
+	# creates the missing repository, at state's revision when given
+	def bootstrap(self, state=None, partial=False, depth=None):
+		revision = state[STATE_REVISION] if state is not None else None
+		# path may be a symlink to a (not yet existing) shared location
+		os.makedirs(os.path.dirname(os.path.realpath(self.path)), exist_ok=True)
+		self.interface.clone(self.branch, revision, partial, depth)
+	# fast-forwards to the fetched head of the declared branch, returns whether the working copy had to be touched
+	def advance(self):
+		return self.interface.advance(self.branch)
+	# returns whether the working copy had to be touched
+	def materialize(self, state):
+		return self.interface.materializeWorktree(state[STATE_REVISION])
+	# returns whether the working copy had to be touched
+	def update(self, state, clean=False):
 		revision = state[STATE_REVISION]
-		self.interface.updateToRevision(revision)
+		# declared paths may have changed since the last update
+		sparseChanged = self.interface.applySparseCheckout()
+		snapshot = self.getSnapshot()
+		if snapshot.revision == revision and not (clean and snapshot.dirty):
+			return sparseChanged
+		self.interface.updateToRevision(revision, clean)
+		return True
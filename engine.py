@@ -0,0 +1,91 @@
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
+
+# network operations mostly wait on remotes, they may overlap beyond the CPU count
+MIN_NETWORK_JOBS = 8
+
+def defaultJobCount():
+	return os.cpu_count() or 1
+def defaultNetworkJobCount():
+	return max(defaultJobCount(), MIN_NETWORK_JOBS)
+
+# Runs per-dependency queries on a bounded worker pool. Queries mostly wait on
+# versioning system processes, so threads are enough. Results are returned in
+# the order dependencies were passed in, whatever order the workers finish in.
+class QueryEngine:
+	def __init__(self, jobs=None):
+		self.jobs = jobs if jobs else defaultJobCount()
+		self.networkJobs = jobs if jobs else defaultNetworkJobCount()
+		logging.debug("query engine: %d job(s), %d network job(s)" % (self.jobs, self.networkJobs))
+
+	def workerCount(self, deps, network):
+		return min(self.networkJobs if network else self.jobs, len(deps))
+
+	def map(self, function, deps, network=False):
+		deps = list(deps)
+		workers = self.workerCount(deps, network)
+		if workers <= 1:
+			return [(dep, function(dep)) for dep in deps]
+		with ThreadPoolExecutor(max_workers=workers) as pool:
+			results = list(pool.map(function, deps))
+		return list(zip(deps, results))
+
+	# yields (dep, result) pairs as soon as each of them is available
+	def imapUnordered(self, function, deps, network=False):
+		deps = list(deps)
+		workers = self.workerCount(deps, network)
+		if workers <= 1:
+			for dep in deps:
+				yield (dep, function(dep))
+			return
+		with ThreadPoolExecutor(max_workers=workers) as pool:
+			futures = {pool.submit(function, dep): dep for dep in deps}
+			for future in as_completed(futures):
+				yield (futures[future], future.result())
+
+# Runs an operation once per key: concurrent (and later) callers with the same
+# key wait for, and share, the result of the first one.
+class SharedOperations:
+	def __init__(self):
+		self.futures = {}
+		self.lock = threading.Lock()
+
+	def run(self, key, operation):
+		with self.lock:
+			future = self.futures.get(key)
+			owner = future is None
+			if owner:
+				future = Future()
+				self.futures[key] = future
+		if owner:
+			try:
+				future.set_result(operation())
+			except BaseException as e:
+				future.set_exception(e)
+		return future.result()
@@ -0,0 +1,166 @@
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import asyncio
+import logging
+import os
+import signal
+import threading
+import time
+
+from common import *
+from engine import *
+
+# Runs versioning system commands as asyncio subprocesses on a single
+# background event loop. A global semaphore bounds how many commands run at
+# once, every command gets a timeout counted from when it actually starts (time
+# spent waiting for its turn only counts against the overall deadline), and
+# children are killed when they time out or when their caller is cancelled.
+# Synchronous callers block on the loop (executeCommand), coroutines can await
+# it from any loop (executeCommandAsync).
+class CommandExecutor:
+	def __init__(self, concurrency=None, timeout=None, deadline=None):
+		self.concurrency = concurrency if concurrency else defaultNetworkJobCount()
+		self.timeout = timeout # seconds per command, None for no limit
+		self.deadline = None # time.monotonic() based
+		if deadline is not None:
+			self.deadline = time.monotonic() + deadline
+		self.loop = None
+		self.thread = None
+		self.semaphore = None
+		self.lock = threading.Lock()
+
+	def startLoop(self):
+		with self.lock:
+			if self.loop is None:
+				loop = asyncio.new_event_loop()
+				ready = threading.Event()
+				failures = []
+				def runLoop():
+					try:
+						asyncio.set_event_loop(loop)
+						self.semaphore = asyncio.Semaphore(self.concurrency)
+					except BaseException as e:
+						# raised again by the waiting caller
+						failures.append(e)
+						loop.close()
+						return
+					finally:
+						ready.set()
+					loop.run_forever()
+					# its selector & self-pipe would stay open until garbage collected
+					loop.close()
+				thread = threading.Thread(target=runLoop, name="glue-executor", daemon=True)
+				thread.start()
+				ready.wait()
+				if failures:
+					raise failures[0]
+				self.loop = loop
+				self.thread = thread
+			return self.loop
+
+	# seconds left before the overall deadline, None without one
+	def remainingTime(self):
+		if self.deadline is None:
+			return None
+		return self.deadline - time.monotonic()
+
+	async def run(self, args, cwd, timeout=None):
+		remaining = self.remainingTime()
+		if remaining is not None and remaining <= 0:
+			raiseError("Deadline exceeded before executing command '%s'" % " ".join(args))
+		try:
+			# the deadline covers waiting for a slot too
+			return await asyncio.wait_for(self.runLimited(args, cwd, timeout), remaining)
+		except asyncio.TimeoutError:
+			logging.error("Deadline exceeded while executing command '%s'" % (" ".join(args)))
+			raiseError("Command '%s' in %s exceeded the deadline" % (" ".join(args), cwd))
+
+	async def runLimited(self, args, cwd, timeout=None):
+		async with self.semaphore:
+			timeout = timeout if timeout is not None else self.timeout
+			try:
+				return await asyncio.wait_for(self.runProcess(args, cwd, timeout is not None or self.deadline is not None), timeout)
+			except asyncio.TimeoutError:
+				logging.error("Timeout (%.1fs) while executing command '%s'" % (timeout, " ".join(args)))
+				raiseError("Command '%s' timed out in %s" % (" ".join(args), cwd))
+
+	async def runProcess(self, args, cwd, detached):
+		# Commands that may time out run in their own session: they can't block
+		# on a terminal prompt, and their whole process group (ssh, remote
+		# helpers...) can be killed. Otherwise they keep the terminal, like before.
+		process = await asyncio.create_subprocess_exec(*args, cwd=cwd, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, start_new_session=detached)
+		try:
+			(out, error) = await process.communicate()
+		except BaseException:
+			# timed out or cancelled: don't leave the child behind
+			if process.returncode is None:
+				try:
+					if detached:
+						os.killpg(process.pid, signal.SIGKILL)
+					else:
+						process.kill()
+				except ProcessLookupError:
+					pass
+				await process.wait()
+			raise
+		return (process.returncode, out, error)
+
+	def execute(self, args, cwd, timeout=None):
+		future = asyncio.run_coroutine_threadsafe(self.run(args, cwd, timeout), self.startLoop())
+		try:
+			return future.result()
+		except BaseException:
+			# KeyboardInterrupt and such: cancelling the task kills the child
+			future.cancel()
+			raise
+
+	async def executeAsync(self, args, cwd, timeout=None):
+		loop = self.startLoop()
+		if asyncio.get_running_loop() is loop:
+			return await self.run(args, cwd, timeout)
+		return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self.run(args, cwd, timeout), loop))
+
+	def close(self):
+		with self.lock:
+			if self.loop is not None:
+				self.loop.call_soon_threadsafe(self.loop.stop)
+				if threading.current_thread() is not self.thread:
+					self.thread.join()
+				self.loop = None
+				self.thread = None
+
+executor = CommandExecutor()
+
+def configureExecution(concurrency=None, timeout=None, deadline=None):
+	global executor
+	# reconfigured on every command of a daemon: no loop thread left behind
+	executor.close()
+	executor = CommandExecutor(concurrency, timeout, deadline)
+
+# returns (return code, output bytes, error output bytes)
+def executeCommand(args, cwd, timeout=None):
+	return executor.execute(args, cwd, timeout)
+async def executeCommandAsync(args, cwd, timeout=None):
+	return await executor.executeAsync(args, cwd, timeout)
@@ -25,13 +25,18 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import json
 import logging
 import sys
+import time
 import argparse
 
 from common import *
 from dependency import *
 from project import *
+from execution import configureExecution
+from watcher import Watcher
+import daemon
 import style
 
 COMMAND_HELP = "help"
@@ -42,12 +47,77 @@ COMMAND_ADVANCE = "advance"
 COMMAND_UPDATE = "update"
 COMMAND_CHECK = "check" # check committed status, fails otherwise
 COMMAND_BUILDVERSION = "buildversion" # returns a build version from workspace repository
+COMMAND_BOOTSTRAP = "bootstrap" # clones missing dependencies
+COMMAND_MATERIALIZE = "materialize" # worktrees of machine-wide mirrors at recorded states
+COMMAND_DRIFT = "drift" # distances between recorded states, HEAD & upstream
+COMMAND_DAEMON = daemon.COMMAND_DAEMON # resident process serving the other commands
+COMMAND_WATCH = "watch" # live status
+
+# argparse type for counts, at least 1
+def positiveInteger(value):
+	try:
+		count = int(value)
+	except ValueError:
+		raise argparse.ArgumentTypeError("invalid int value: '%s'" % value)
+	if count < 1:
+		raise argparse.ArgumentTypeError("must be at least 1, got %d" % count)
+	return count
+
+# aliases of a dependency (symlinks to it) share its working copy, they're counted once
+def workingCopyCount(deps):
+	return len(set(dep.realPath() for dep in deps))
+
+def errorMessage(e):
+	return e.message if hasattr(e, 'message') else str(e)
+
+def printDependencyStatus(dep, snapshot, remote=False, fetchDuration=None):
+	uncommitted = snapshot.dirty
+	remoteStatus = ""
+	if remote:
+		s = (snapshot.ahead, snapshot.behind)
+		if s[0] > 0 or s[1] > 0:
+			remoteStatus = "%d"%s[0] + style.cyan("↑")+ " %d"%s[1] + style.cyan("↓")
+	# rev = 'uncommitted' if uncommitted else dep.getRevision()
+	print("%s (at %s/, type=%s):" % (style.dependency(dep.name), dep.path, dep.type))
+	print("\tstatus: %s %s" % ( style.error('uncommitted') if uncommitted else style.ok('clean') , remoteStatus))
+	print("\tcurrent branch: %s" % (style.branch(snapshot.branch)))
+	print("\trevision: %s" % (style.revision(snapshot.revision)))
+	if fetchDuration is not None:
+		print("\tfetched in %.1fs" % (fetchDuration))
+
+def distanceString(distance):
+	if distance is None:
+		return style.warning("unknown")
+	if distance == (0, 0):
+		return style.ok("same")
+	return "%d" % distance[0] + style.cyan("↑") + " %d" % distance[1] + style.cyan("↓")
+
+def printDependencyDrift(dep, drift):
+	print("%s (at %s/, type=%s):" % (style.dependency(dep.name), dep.path, dep.type))
+	print("\tHEAD vs recorded: %s" % distanceString(drift.headFromRecorded))
+	print("\tupstream vs HEAD: %s" % distanceString(drift.upstreamFromHead))
+	print("\tupstream vs recorded: %s" % distanceString(drift.upstreamFromRecorded))
+
+def dependencyStatusLine(dep, snapshot):
+	status = style.error('uncommitted') if snapshot.dirty else style.ok('clean')
+	remoteStatus = ""
+	if snapshot.ahead > 0 or snapshot.behind > 0:
+		remoteStatus = " %d" % snapshot.ahead + style.cyan("↑") + " %d" % snapshot.behind + style.cyan("↓")
+	return "%s %s: %s, %s at %s%s" % (time.strftime("%H:%M:%S"), style.dependency(dep.name), status, style.branch(snapshot.branch), style.revision(snapshot.revision), remoteStatus)
 
 def prepareLogger(level=logging.DEBUG):
 	logging.basicConfig(stream=sys.stderr, level=level, format="%(levelname)s: %(message)s")
 	#	logging.debug('A debug message!')
 	#	logging.info('We processed records')
+# runs the command in the project's daemon when there's one, in-process otherwise
 def main(argv):
+	code = daemon.forward(argv)
+	if code is not None:
+		sys.exit(code)
+	run(argv)
+
+# projectFor(jobs): project to use, a new one when None
+def run(argv, projectFor=None):
 	prepareLogger(logging.WARN)
 	logging.debug("args = %s", ", ".join(argv))
 
@@ -60,6 +130,16 @@ def main(argv):
 	# group.add_argument('-u', '--update', dest='update', action='store_true', help='Update project dependencies to given (or current) recorded states.')
 
 	parser = argparse.ArgumentParser(description='Glue: Automating dependent repositories operations.')
+	parser.add_argument('-j', '--jobs', dest='jobs', type=positiveInteger, default=None, help='Number of dependencies queried concurrently (defaults to the number of CPUs).')
+	parser.add_argument('--cat-file', dest='catfile', action='store_true', help='Resolve git revisions through one persistent cat-file process per repository.')
+	parser.add_argument('--hg-server', dest='hgserver', action='store_true', help='Run Mercurial commands through one persistent command server per repository (no --timeout or --deadline then).')
+	parser.add_argument('--timeout', dest='timeout', type=float, default=None, help='Maximum duration (in seconds) of each versioning system command.')
+	parser.add_argument('--deadline', dest='deadline', type=float, default=None, help='Maximum duration (in seconds) of all versioning system commands, as a whole.')
+	parser.add_argument('--cache', dest='cache', action='store_true', help='Reuse dependency status and parsed %s/%s files stored in %s while they are unchanged.' % (GLUEDEPS_FILENAME, GLUESTATES_FILENAME, GLUECACHE_DIRNAME))
+	parser.add_argument('--cache-safe', dest='cachesafe', action='store_true', help='Like --cache, but always re-checks dependencies for uncommitted changes.')
+	parser.add_argument('--mirror', dest='mirror', action='store_true', help='Clone & fetch git dependencies through machine-wide mirrors, so their objects are downloaded & stored once.')
+	parser.add_argument('--mirror-dir', dest='mirrordir', default=None, help='Mirrors location (implies --mirror, defaults to $%s or %s).' % (MIRROR_DIR_ENV, DEFAULT_MIRROR_DIR))
+	parser.add_argument('--dissociate', dest='dissociate', action='store_true', help='With mirrors, clones copy objects instead of borrowing them from the mirror (clones borrowing objects break if their mirror is deleted).')
 	subparsers = parser.add_subparsers(help='sub-command help', dest='command')
 
 	raw_option_help = 'Raw result only, skips descriptive text and formating'
@@ -79,6 +159,7 @@ def main(argv):
 	subparser = subparsers.add_parser(COMMAND_ADVANCE, help=help)
 	subparser.add_argument('deps', nargs='*', help='The list of dependencies to advance.')
 	subparser.add_argument('-a', '--all', dest='all', action='store_true', help='Advances all dependencies.')
+	subparser.add_argument('-r', '--record', dest='record', action='store_true', help='Records the new states in %s afterwards.' % (GLUESTATES_FILENAME))
 
 	# Record
 	help = 'Record project dependencies and generate new %s file.' % (GLUESTATES_FILENAME)
@@ -99,11 +180,53 @@ def main(argv):
 	subparser = subparsers.add_parser(COMMAND_BUILDVERSION, help=help)
 	subparser.add_argument('-0', '--raw', dest='raw', action='store_true', help=raw_option_help)
 
+	# Bootstrap
+	help = 'Clone missing dependencies and check out their recorded states (or branch head when there is no %s file).' % (GLUESTATES_FILENAME)
+	subparser = subparsers.add_parser(COMMAND_BOOTSTRAP, help=help)
+	subparser.add_argument('-p', '--partial', dest='partial', action='store_true', help='Partial clones, file contents are downloaded on demand (git only).')
+	subparser.add_argument('-d', '--depth', dest='depth', type=int, default=None, help='Shallow clones, limited to the given number of commits (git only).')
+
+	# Materialize
+	help = 'Create or update dependencies as git worktrees of machine-wide mirrors, at given (or current) recorded states. Worktrees already at the right revision are left untouched.'
+	subparser = subparsers.add_parser(COMMAND_MATERIALIZE, help=help)
+	subparser.add_argument('-s', '--states', dest='states', default=None, help='States file to materialize (defaults to the project %s file).' % (GLUESTATES_FILENAME))
+
+	# Drift
+	help = 'Print, for each dependency, commits ahead (↑) & behind (↓) between HEAD and its recorded state, and between the last fetched head of its branch (upstream) and both.'
+	subparser = subparsers.add_parser(COMMAND_DRIFT, help=help)
+	subparser.add_argument('-r', '--remote', dest='remote', action='store_true', help='Fetches dependencies first.')
+	subparser.add_argument('--json', dest='json', action='store_true', help='JSON output, one object per dependency name.')
+
+	# Watch
+	help = 'Print status for each dependency, then a line (or JSON event) for each dependency whose status changes, until interrupted.'
+	subparser = subparsers.add_parser(COMMAND_WATCH, help=help)
+	subparser.add_argument('--json', dest='json', action='store_true', help='Newline-delimited JSON events, one per dependency status.')
+	subparser.add_argument('-i', '--interval', dest='interval', type=float, default=1.0, help='Seconds between checks when repositories changes can\'t be watched (inotify is Linux only).')
+
+	# Daemon
+	help = 'Serve the commands run in this project from a resident process, answering faster (set $%s to bypass it).' % (daemon.NO_DAEMON_ENV)
+	subparser = subparsers.add_parser(COMMAND_DAEMON, help=help)
+	subparser.add_argument('--stop', dest='stop', action='store_true', help='Stops the running daemon.')
+
 	#group.add_argument('-l', '--list', dest='list', action='store_true', help='Lists all project dependencies, as declared in the %s file.' % (GLUEDEPS_FILENAME))
 
 	args = parser.parse_args(argv[1:])
-
-	project = Project()
+	if args.hgserver and (args.timeout is not None or args.deadline is not None):
+		# commands sent to a command server aren't separate processes, they can't be timed out
+		parser.error("--hg-server can't be combined with --timeout or --deadline")
+
+	configureExecution(args.jobs, args.timeout, args.deadline)
+	GitInterface.useCatFile = args.catfile
+	GitInterface.mirrors = MirrorStore(GIT_BINARY, args.mirrordir, args.dissociate) if args.mirror or args.mirrordir else None
+	MercurialInterface.useCommandServer = args.hgserver
+	if args.command == COMMAND_DAEMON and args.stop:
+		if not daemon.stop():
+			print("No daemon running")
+		return
+	def loadProject():
+		return projectFor(args.jobs) if projectFor is not None else Project(jobs=args.jobs, cache=args.cache or args.cachesafe)
+	project = loadProject()
+	GitInterface.statusCache = StatusCache(project.cachePath(), safe=args.cachesafe) if args.cache or args.cachesafe else None
 
 	#deps = project.dependencies # type: list[Dependency]
 
@@ -121,28 +244,52 @@ def main(argv):
 			logging.debug("get dependency status")
 			project.failIfMissingDependencies()
 			if args.remote:
-				print("Fetching…")
-				for dep in project.dependencies:
-					dep.fetch()
-					sys.stdout.write(dep.name + " ")
-					sys.stdout.flush()
-				sys.stdout.write("\n")
-
-			for dep in project.dependencies:
-				uncommitted = dep.hasUncommittedChanges()
-				remoteStatus = ""
-				if args.remote:
-					s = dep.getRemoteChanges()
-					if s[0] > 0 or s[1] > 0:
-						remoteStatus = "%d"%s[0] + style.cyan("↑")+ " %d"%s[1] + style.cyan("↓")
-				# rev = 'uncommitted' if uncommitted else dep.getRevision()
-				print("%s (at %s/, type=%s):" % (style.dependency(dep.name), dep.path, dep.type))
-				print("\tstatus: %s %s" % ( style.error('uncommitted') if uncommitted else style.ok('clean') , remoteStatus))
-				print("\tcurrent branch: %s" % (style.branch(dep.getCurrentBranch())))
-				print("\trevision: %s" % (style.revision(dep.getRevision())))
+				# each dependency is printed as soon as its own fetch is done
+				pending = [dep.name for dep in project.getSortedDependencies()]
+				failed = []
+				progress = style.ProgressLine(sys.stdout)
+				progress.update("Fetching… %s" % ", ".join(pending))
+				for dep, (duration, error, snapshot) in project.streamFetches(Dependency.getSnapshot):
+					pending.remove(dep.name)
+					progress.clear()
+					if error is not None:
+						failed.append(dep)
+						print("%s (at %s/, type=%s):" % (style.dependency(dep.name), dep.path, dep.type))
+						print("\tfetch: %s (%.1fs)\n\t\t%s" % (style.error('failed'), duration, errorMessage(error).strip()))
+					else:
+						printDependencyStatus(dep, snapshot, remote=True, fetchDuration=duration)
+					if pending:
+						progress.update("Fetching… %s" % ", ".join(pending))
+				if failed:
+					raiseError("Fetch failed for: %s" % ", ".join(dep.name for dep in failed))
+			else:
+				for dep, snapshot in project.snapshots():
+					printDependencyStatus(dep, snapshot)
 		elif args.command == COMMAND_ADVANCE:
 			logging.debug("advancing deps: %s" % ", ".join(args.deps))
 			project.failIfMissingDependencies()
+			if args.all:
+				deps = project.dependencies
+			elif args.deps:
+				deps = project.dependenciesNamed(args.deps)
+			else:
+				raiseError("No dependency to advance, pass their names or --all")
+			uncommittedDeps = [dep for dep in project.uncommittedDependencies() if dep in deps]
+			if len(uncommittedDeps) > 0:
+				raiseError("Aborting. The following dependencies have uncommitted changes:\n\t%s" % ", ".join(dep.name for dep in uncommittedDeps))
+			results = project.advanceDependencies(deps)
+			failed = []
+			for dep, (duration, error, advanced) in results:
+				if error is not None:
+					failed.append(dep)
+					print("%s: %s (%.1fs)\n\t%s" % (style.dependency(dep.name), style.error('advance failed'), duration, errorMessage(error).strip()))
+				elif advanced:
+					print("%s: advanced to %s (%.1fs)" % (style.dependency(dep.name), style.revision(dep.getRevision()), duration))
+			if failed:
+				raiseError("Advance failed for: %s" % ", ".join(dep.name for dep in failed))
+			print("%d of %d dependencies advanced" % (len([dep for dep, (duration, error, advanced) in results if advanced]), len(results)))
+			if args.record:
+				project.recordDepsStates()
 		elif args.command == COMMAND_RECORD:
 			logging.debug("recording revisions for dependencies")
 			project.failIfMissingDependencies()
@@ -151,14 +298,21 @@ def main(argv):
 			logging.debug("updating dependencies (clean: %d)" % (args.clean))
 			# update main project if requested (and its states file)
 			project.failIfMissingDependencies()
-			project.failIfUncommittedDependencies()
+			if not args.clean:
+				project.failIfUncommittedDependencies()
 
 			# read states
 			states = project.loadStates()
+			# only when recorded revisions aren't already there
+			project.fetchMissingRevisions(states)
 
-			print("states: " + states)
 			# update dependencies
-			# project.updateDependencies(states)
+			results = project.updateDependencies(states, args.clean)
+			for dep, (updated, duration) in results:
+				if updated:
+					print("%s: updated to %s (%.1fs)" % (style.dependency(dep.name), style.revision(states[dep.name][STATE_REVISION]), duration))
+			updatedCount = workingCopyCount([dep for dep, (updated, duration) in results if updated])
+			print("%d of %d dependencies updated" % (updatedCount, workingCopyCount([dep for dep, result in results])))
 		elif args.command == COMMAND_CHECK:
 			logging.debug("checking deps")
 			# project.failIfUncommittedDependencies()
@@ -187,11 +341,106 @@ def main(argv):
 			else:
 				fbuildversion = style.warning(buildversion)+" (uncommitted changed)" if dirty else style.ok(buildversion)
 				print("Build Version: %s" % fbuildversion)
+		elif args.command == COMMAND_BOOTSTRAP:
+			logging.debug("bootstrapping deps")
+			# dependencies without a recorded state get their branch head
+			states = project.loadStates(check=False) if project.hasStates() else None
+			results = project.bootstrapDependencies(states, args.partial, args.depth)
+			failed = []
+			for dep, (duration, error) in results:
+				if error is not None:
+					failed.append(dep)
+					print("%s: %s (%.1fs)\n\t%s" % (style.dependency(dep.name), style.error('clone failed'), duration, errorMessage(error).strip()))
+				else:
+					print("%s: cloned into %s/ (%.1fs)" % (style.dependency(dep.name), dep.path, duration))
+			if failed:
+				raiseError("Bootstrap failed for: %s" % ", ".join(dep.name for dep in failed))
+			print("%d dependencies cloned" % (workingCopyCount([dep for dep, result in results])))
+		elif args.command == COMMAND_MATERIALIZE:
+			logging.debug("materializing deps")
+			states = project.loadStates(path=args.states)
+			if [dep for dep in project.dependencies if dep.type != 'git']:
+				raiseError("Only git dependencies can be materialized as worktrees")
+			results = project.materializeDependencies(states)
+			failed = []
+			for dep, (updated, duration, error) in results:
+				if error is not None:
+					failed.append(dep)
+					print("%s: %s (%.1fs)\n\t%s" % (style.dependency(dep.name), style.error('failed'), duration, errorMessage(error).strip()))
+				elif updated:
+					print("%s: %s at %s (%.1fs)" % (style.dependency(dep.name), dep.path, style.revision(states[dep.name][STATE_REVISION]), duration))
+			if failed:
+				raiseError("Materialization failed for: %s" % ", ".join(dep.name for dep in failed))
+			print("%d of %d dependencies updated" % (workingCopyCount([dep for dep, r in results if r[0]]), workingCopyCount([dep for dep, r in results])))
+		elif args.command == COMMAND_DRIFT:
+			logging.debug("computing drift")
+			project.failIfMissingDependencies()
+			states = project.loadStates(check=False) if project.hasStates() else None
+			if args.remote:
+				project.fetchDependencies(states)
+			drifts = project.drifts(states)
+			if args.json:
+				print(json.dumps(dict((dep.name, drift.toDict()) for dep, drift in drifts), indent="\t", sort_keys=True))
+			else:
+				for dep, drift in drifts:
+					printDependencyDrift(dep, drift)
+		elif args.command == COMMAND_WATCH:
+			logging.debug("watching deps")
+			project.failIfMissingDependencies()
+			try:
+				while True:
+					try:
+						watcher = Watcher()
+						project.watch(watcher)
+					except OSError as e:
+						logging.info("Not watching repositories (%s), polling them every %.1fs" % (e, args.interval))
+						watcher = None
+					initial = set(project.dependencies)
+					for dep, snapshot in project.streamSnapshots(watcher, args.interval):
+						if args.json:
+							event = {"event": "status" if dep in initial else "change", "dependency": dep.name, "time": time.time(), "snapshot": snapshot.toDict()}
+							print(json.dumps(event), flush=True)
+						elif dep in initial:
+							printDependencyStatus(dep, snapshot, remote=True)
+						else:
+							print(dependencyStatusLine(dep, snapshot), flush=True)
+						initial.discard(dep)
+					# project files changed
+					watcher.close()
+					queryCache.invalidate()
+					project = loadProject()
+					if not args.json:
+						print("%s: reloaded" % (GLUEDEPS_FILENAME))
+			except KeyboardInterrupt:
+				pass
+		elif args.command == COMMAND_DAEMON:
+			if projectFor is not None:
+				raiseError("Already running in the daemon")
+			try:
+				watcher = Watcher()
+			except OSError as e:
+				logging.info("Not watching repositories (%s), they'll be queried again for every command" % e)
+				watcher = None
+			def createProject(jobs):
+				project = Project(jobs=jobs)
+				if watcher is not None:
+					project.watch(watcher)
+				return project
+			def prepare():
+				changes = watcher.changes() if watcher is not None else None
+				if changes is None:
+					queryCache.invalidateVolatile()
+					return watcher is not None
+				for key in changes:
+					queryCache.invalidate(key)
+				return project.watchKey() in changes
+			server = daemon.Daemon(".", run, createProject, project.gluedepsPath(), prepare)
+			server.serve()
 		else:
 			raiseError("Unrecognized command '%s'" % " ".join(argv[1:]))
 
 	except Exception as e:
-		print(e.message)
+		print(errorMessage(e))
 		return sys.exit(1)
 
 		# uncommittedDeps = project.uncommittedDependencies()
@@ -0,0 +1,142 @@
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import atexit
+import logging
+import os
+import struct
+import subprocess
+import threading
+
+from common import *
+
+# see https://www.mercurial-scm.org/wiki/CommandServer
+CHANNEL_OUTPUT = b'o'
+CHANNEL_ERROR = b'e'
+CHANNEL_RESULT = b'r'
+CHANNEL_DEBUG = b'd'
+CHANNEL_INPUT = b'I'
+CHANNEL_LINE_INPUT = b'L'
+
+# Mercurial command server ('hg serve --cmdserver pipe'), running commands
+# without paying hg's startup cost each time. There is at most one per
+# repository (see forRepository), started on first use and stopped when glue exits.
+class CommandServer:
+	servers = {}
+	serversLock = threading.Lock()
+
+	def __init__(self, executable, path):
+		self.executable = executable
+		self.path = path
+		self.process = None
+		self.encoding = "UTF-8"
+		self.lock = threading.Lock()
+
+	@classmethod
+	def forRepository(cls, executable, path):
+		key = os.path.realpath(path)
+		with cls.serversLock:
+			server = cls.servers.get(key)
+			if server is None:
+				server = CommandServer(executable, path)
+				cls.servers[key] = server
+			return server
+
+	@classmethod
+	def closeAll(cls):
+		with cls.serversLock:
+			for server in cls.servers.values():
+				server.close()
+			cls.servers = {}
+
+	def start(self):
+		logging.debug("starting hg command server in %s" % self.path)
+		env = dict(os.environ)
+		env["HGPLAIN"] = "1"
+		env["HGENCODING"] = self.encoding
+		self.process = subprocess.Popen([self.executable, "serve", "--cmdserver", "pipe"], cwd=self.path, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+		channel, data = self.readMessage()
+		hello = data.decode(self.encoding, "replace")
+		# "capabilities: getencoding runcommand\nencoding: UTF-8\npid: 1234"
+		fields = dict(line.split(": ", 1) for line in hello.splitlines() if ": " in line)
+		if channel != CHANNEL_OUTPUT or "runcommand" not in fields.get("capabilities", "").split():
+			self.close()
+			raiseError("Unexpected hg command server greeting in %s" % self.path)
+		self.encoding = fields.get("encoding", self.encoding)
+
+	def close(self):
+		if self.process is None:
+			return
+		try:
+			self.process.stdin.close()
+			self.process.wait()
+		except (OSError, ValueError):
+			self.process.kill()
+		self.process = None
+
+	def readExactly(self, size):
+		data = b''
+		while len(data) < size:
+			chunk = self.process.stdout.read(size - len(data))
+			if not chunk:
+				self.close()
+				raiseError("hg command server stopped unexpectedly in %s" % self.path)
+			data += chunk
+		return data
+
+	def readMessage(self):
+		channel, length = struct.unpack(">cI", self.readExactly(5))
+		if channel in (CHANNEL_INPUT, CHANNEL_LINE_INPUT):
+			# input requests carry the wanted size, not data
+			return (channel, length)
+		return (channel, self.readExactly(length))
+
+	# runs hg command (argument list), returns (return code, output, error output)
+	def runCommand(self, args):
+		with self.lock:
+			if self.process is None:
+				self.start()
+			data = b'\0'.join(arg.encode(self.encoding) for arg in args)
+			self.process.stdin.write(b'runcommand\n' + struct.pack(">I", len(data)) + data)
+			self.process.stdin.flush()
+			out = b''
+			error = b''
+			while True:
+				channel, data = self.readMessage()
+				if channel == CHANNEL_OUTPUT:
+					out += data
+				elif channel == CHANNEL_ERROR:
+					error += data
+				elif channel == CHANNEL_RESULT:
+					return (struct.unpack(">i", data)[0], out.decode(self.encoding), error.decode(self.encoding))
+				elif channel in (CHANNEL_INPUT, CHANNEL_LINE_INPUT):
+					# commands are never interactive, answer with end of input
+					self.process.stdin.write(struct.pack(">I", 0))
+					self.process.stdin.flush()
+				elif channel.isupper():
+					# required channel we don't know about
+					self.close()
+					raiseError("Unsupported hg command server channel '%s'" % channel.decode())
+
+atexit.register(CommandServer.closeAll)
@@ -23,40 +23,167 @@
 # SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import shlex
-import subprocess
 import logging
 import os
+import functools
+import threading
+from concurrent.futures import Future
+
+import execution
+
+from common import *
+from catfile import *
+from refs import *
+from hgserver import *
+from statuscache import *
+from revcount import *
+from mirror import *
 
 GIT_BINARY = "/usr/bin/git"
 HG_BINARY = "/usr/local/bin/hg"
+# first-parent commits looked at when searching for a counted ancestor
+ANCESTOR_SEARCH_LIMIT = 10000
+
+# Repository state gathered in one go: current revision & branch, upstream
+# tracking (ahead/behind counts) and whether the working copy has uncommitted changes.
+class Snapshot:
+	def __init__(self, revision, branch, date, dirty, upstream=None, ahead=0, behind=0):
+		self.revision = revision
+		self.branch = branch
+		self.date = date
+		self.dirty = dirty
+		self.upstream = upstream
+		self.ahead = ahead
+		self.behind = behind
+	def toDict(self):
+		return dict(vars(self))
+	@staticmethod
+	def fromDict(values):
+		return Snapshot(**values)
+	def __repr__(self):
+		return 'Snapshot(revision=%s branch=%s dirty=%s upstream=%s ahead=%d behind=%d)' % (self.revision, self.branch, self.dirty, self.upstream, self.ahead, self.behind)
+
+# Memoized repository queries, keyed by (repository, query & arguments). Lives
+# for the whole invocation, entries are dropped when a mutating operation runs
+# on their repository's storage (so that worktrees & aliases sharing it are
+# refreshed too). Concurrent requests for the same key share one computation.
+#
+# Stable entries only depend on immutable objects (full revision ids), they
+# survive invalidateVolatile (long-lived processes, see daemon.py).
+class QueryCache:
+	def __init__(self):
+		self.entries = {} # key -> Future
+		self.storages = {} # repository -> storage key
+		self.stable = set() # keys
+		self.lock = threading.Lock()
+	def get(self, key, storage, compute, stable=False):
+		with self.lock:
+			future = self.entries.get(key)
+			owner = future is None
+			if owner:
+				future = Future()
+				self.entries[key] = future
+				self.storages[key[0]] = storage
+				if stable:
+					self.stable.add(key)
+		if owner:
+			try:
+				future.set_result(compute())
+			except BaseException as e:
+				# failures aren't cached
+				with self.lock:
+					if self.entries.get(key) is future:
+						del self.entries[key]
+				future.set_exception(e)
+		return future.result()
+	def invalidate(self, storage=None):
+		with self.lock:
+			if storage is None:
+				self.entries = {}
+			else:
+				self.entries = {key: value for key, value in self.entries.items() if self.storages.get(key[0]) != storage}
+			self.stable &= set(self.entries)
+	# drops everything that depends on the current state of repositories
+	def invalidateVolatile(self):
+		with self.lock:
+			self.entries = {key: value for key, value in self.entries.items() if key in self.stable}
+
+queryCache = QueryCache()
+
+# decorates an interface method answering a question about the repository
+def query(method):
+	@functools.wraps(method)
+	def cachedQuery(self, *args, **kwargs):
+		key = (self.repositoryKey(), method.__name__) + args + tuple(sorted(kwargs.items()))
+		return queryCache.get(key, self.storageKey(), lambda: method(self, *args, **kwargs))
+	return cachedQuery
+
+# same, for questions about given revisions only: stable when they're all full ids
+def revisionQuery(method):
+	@functools.wraps(method)
+	def cachedQuery(self, *args):
+		key = (self.repositoryKey(), method.__name__) + args
+		stable = len(args) > 0 and all(OBJECT_ID.match(arg) for arg in args)
+		return queryCache.get(key, self.storageKey(), lambda: method(self, *args), stable)
+	return cachedQuery
+
+# decorates an interface method changing the repository
+def mutation(method):
+	@functools.wraps(method)
+	def mutatingOperation(self, *args, **kwargs):
+		try:
+			return method(self, *args, **kwargs)
+		finally:
+			queryCache.invalidate(self.storageKey())
+	return mutatingOperation
 
 class VersioningSystemInterface:
-	def __init__(self, path, url):
+	def __init__(self, path, url, sparsePaths=None):
 		self.executable = None
 		self.path = path
 		self.url = url
+		# directories to check out (all when None)
+		self.sparsePaths = sparsePaths
 		# os.path.isdir()
+	# identifies the working copy (aliases through symlinks share it)
+	def repositoryKey(self):
+		return os.path.realpath(self.path)
+	# identifies where history is stored (worktrees & shares of a repository have the same)
+	def storageKey(self):
+		return self.repositoryKey()
 	@staticmethod
 	def interface(path):
-		if os.path.isdir(os.path.join(path, ".git")):
+		if os.path.exists(os.path.join(path, ".git")):
 			return GitInterface(path, "")
 		elif os.path.isdir(os.path.join(path, ".hg")):
 			return MercurialInterface(path, "")
 		else:
 			return None
-	def executeCommand(self, args): # "%s %s" % (GitInterface.GIT_PATH, args)
-		sargs = [self.executable] + shlex.split(args)
-		pro = subprocess.Popen(sargs, cwd = self.path, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-		(out, error) = pro.communicate()
-		ret = pro.returncode
-		if ret != 0 > 0:
+	def commandArguments(self, args):
+		return [self.executable] + shlex.split(args)
+	def commandOutput(self, sargs, result):
+		(ret, out, error) = result
+		if ret != 0:
 			logging.error("Error %d while executing command '%s'" % (ret, " ".join(sargs)))
-			raise StandardError(error)
-
+			raiseError(error.decode())
 		return out.decode()
+	def executeCommand(self, args, cwd=None): # "%s %s" % (GitInterface.GIT_PATH, args)
+		sargs = self.commandArguments(args)
+		return self.commandOutput(sargs, execution.executeCommand(sargs, cwd or self.path))
+	async def executeCommandAsync(self, args, cwd=None):
+		sargs = self.commandArguments(args)
+		return self.commandOutput(sargs, await execution.executeCommandAsync(sargs, cwd or self.path))
+	# creates the repository at path from url (the parent directory must exist)
+	# and checks out revision, or branch head when None. partial/depth limit
+	# what is downloaded, where supported.
+	def clone(self, branch, revision=None, partial=False, depth=None):
+		raise NotImplementedError
 	def exists(self):
 		raise NotImplementedError
-	def fetch(self):
+	# fetches branch (all branches when None) and the given revisions
+	def fetch(self, branch=None, revisions=()):
+		raise NotImplementedError
+	def hasRevision(self, revision):
 		raise NotImplementedError
 	def hasUncommittedChanges(self):
 		raise NotImplementedError
@@ -77,66 +204,493 @@ class VersioningSystemInterface:
 		raise NotImplementedError
 	def getCurrentBranch(self):
 		raise NotImplementedError
-	def updateToRevision(self, revision):
+	# (commits only in left, commits only in right)
+	def getDistance(self, left, right):
+		raise NotImplementedError
+	# last fetched head of branch, None when unknown
+	def getUpstreamRevision(self, branch):
+		raise NotImplementedError
+	@query
+	def getSnapshot(self):
+		# generic (slow) path, interfaces override it when state can be queried at once.
+		return Snapshot(self.getRevision(), self.getCurrentBranch(), self.getDate(), self.hasUncommittedChanges())
+	# clean: discards uncommitted changes and removes untracked files
+	def updateToRevision(self, revision, clean=False):
+		raise NotImplementedError
+	# creates or updates the working copy as a worktree of the machine-wide mirror, at revision.
+	# Returns whether the working copy had to be touched.
+	def materializeWorktree(self, revision):
+		raise NotImplementedError
+	# registers whatever can change query answers with watcher (see watcher.py), keyed by storage.
+	def watch(self, watcher):
+		watcher.unwatched.add(self.storageKey())
+	# fast-forwards the working copy to the (fetched) head of branch, fails if it
+	# isn't a fast-forward. Returns whether the working copy had to be touched.
+	def advance(self, branch):
 		raise NotImplementedError
+	# restricts the working copy to sparsePaths (or back to everything when None),
+	# returns whether it had to be changed.
+	def applySparseCheckout(self):
+		if self.sparsePaths is not None:
+			logging.warning("Sparse checkouts aren't supported for %s, checking out everything" % (self.path))
+		return False
 
 class GitInterface(VersioningSystemInterface):
-	def __init__(self, path, url):
-		VersioningSystemInterface.__init__(self, path, url)
+	# resolve revisions & commits through a persistent 'git cat-file' process (see catfile.py)
+	useCatFile = False
+	# persistent snapshots, reused while repository metadata is unchanged (see statuscache.py)
+	statusCache = None
+	# machine-wide mirrors clones & fetches go through (see mirror.py)
+	mirrors = None
+
+	def __init__(self, path, url, sparsePaths=None):
+		VersioningSystemInterface.__init__(self, path, url, sparsePaths)
 		self.executable = GIT_BINARY
+		self.refs = GitRefs(path)
+	def storageKey(self):
+		commondir = self.refs.commonDir()
+		return commondir if commondir is not None else self.repositoryKey()
+	def catFile(self):
+		if not GitInterface.useCatFile:
+			return None
+		return CatFile.forRepository(self.executable, self.path)
 	def exists(self):
-		return os.path.isdir(os.path.join(self.path, ".git"))
-	def fetch(self):
-		self.executeCommand("fetch")
+		# '.git' is a file in worktrees & submodules
+		return os.path.exists(os.path.join(self.path, ".git"))
+	@mutation
+	def fetch(self, branch=None, revisions=()):
+		if branch is None:
+			self.executeCommand("fetch")
+			return
+		# only the declared branch, into its usual remote-tracking ref
+		remote = self.getBranchRemote(branch)
+		refspec = "+refs/heads/%s:refs/remotes/%s/%s" % (branch, remote, branch)
+		missing = [revision for revision in revisions if not self.hasRevision(revision)]
+		# the mirror (when used) is fetched from the network, the dependency from the mirror
+		mirror = self.updateMirror()
+		source = mirror if mirror is not None else remote
+		try:
+			self.executeCommand(" ".join(["fetch", shlex.quote(source), shlex.quote(refspec)] + missing))
+		except Exception:
+			if len(missing) == 0:
+				raise
+			# server refusing to serve revisions by id: fall back to everything
+			logging.warning("Fetching %s by revision failed, fetching all branches" % (self.path))
+			self.executeCommand("fetch %s" % shlex.quote(remote))
+	@mutation
+	def clone(self, branch, revision=None, partial=False, depth=None):
+		destination = os.path.realpath(self.path)
+		args = ["clone", "--no-checkout", "--branch", shlex.quote(branch)]
+		mirror = self.updateMirror()
+		if mirror is not None:
+			# objects are borrowed from (or copied out of) the mirror, nothing to download
+			if partial or depth is not None:
+				logging.info("Cloning %s from its mirror, ignoring partial/depth options" % (self.url))
+				partial = False
+				depth = None
+			args += ["--reference", shlex.quote(mirror)]
+			if GitInterface.mirrors.dissociate:
+				args.append("--dissociate")
+		if partial:
+			args.append("--filter=blob:none")
+		if depth is not None:
+			args.append("--depth %d" % depth)
+		args += [shlex.quote(mirror if mirror is not None else self.url), shlex.quote(destination)]
+		self.executeCommand(" ".join(args), cwd=os.path.dirname(destination))
+		if mirror is not None:
+			self.executeCommand("remote set-url origin %s" % shlex.quote(self.url))
+			self.executeCommand("fetch --quiet %s %s" % (shlex.quote(mirror), shlex.quote("+refs/heads/%s:refs/remotes/origin/%s" % (branch, branch))))
+		# before the first checkout, so that excluded directories are never written
+		self.applySparseCheckout()
+		if revision is None:
+			self.executeCommand("checkout %s" % shlex.quote(branch))
+			return
+		if depth is not None and not self.hasRevision(revision):
+			# recorded revision older than the branch's shallow history
+			self.executeCommand("fetch --depth %d origin %s" % (depth, revision))
+		self.executeCommand("checkout %s" % revision)
+	@mutation
+	def materializeWorktree(self, revision):
+		mirrors = GitInterface.mirrors or MirrorStore(self.executable)
+		mirror = os.path.realpath(mirrors.mirrorWithRevision(self.url, revision))
+		destination = os.path.realpath(self.path)
+		with mirrors.locked(self.url):
+			if os.path.exists(destination):
+				if self.refs.commonDir() != mirror:
+					raiseError("%s is not a worktree of %s, it can't be materialized" % (self.path, mirror))
+				sparseChanged = self.applySparseCheckout()
+				if self.refs.getRevision() == revision:
+					return sparseChanged
+				if self.querySnapshot().dirty:
+					raiseError("%s has uncommitted changes" % (self.path))
+				self.executeCommand("checkout --detach %s" % revision)
+			else:
+				# worktrees of deleted directories (previous jobs) would be in the way
+				self.executeCommand("worktree prune", cwd=mirror)
+				os.makedirs(os.path.dirname(destination), exist_ok=True)
+				self.executeCommand("worktree add --no-checkout --detach %s %s" % (shlex.quote(destination), revision), cwd=mirror)
+				self.applySparseCheckout()
+				self.executeCommand("checkout --detach %s" % revision)
+		return True
+	def sparsePatterns(self):
+		# fails when the working copy isn't sparse
+		(ret, out, error) = execution.executeCommand(self.commandArguments("sparse-checkout list"), self.path)
+		return str.splitlines(out.decode()) if ret == 0 else None
+	# not a @mutation: update calls it for every dependency, cached queries are only dropped when the checkout changes
+	def applySparseCheckout(self):
+		if self.sparsePaths is None:
+			# most working copies never were sparse, no need to ask git about them
+			gitdir = self.refs.gitDir()
+			if gitdir is not None and not os.path.exists(os.path.join(gitdir, "info", "sparse-checkout")):
+				return False
+			if self.sparsePatterns() is None:
+				return False
+			# paths no longer declared: everything again
+			self.executeCommand("sparse-checkout disable")
+			queryCache.invalidate(self.storageKey())
+			return True
+		paths = [path.strip("/") for path in self.sparsePaths]
+		patterns = self.sparsePatterns()
+		if patterns is not None and sorted(patterns) == sorted(paths):
+			return False
+		# cone mode: whole directories, matched by prefix (fast, unlike arbitrary patterns)
+		self.executeCommand(" ".join(["sparse-checkout", "set", "--cone", "--"] + [shlex.quote(path) for path in paths]))
+		queryCache.invalidate(self.storageKey())
+		return True
+	# None when revision doesn't exist
+	def resolveRevision(self, revision):
+		(ret, out, error) = execution.executeCommand(self.commandArguments("rev-parse --verify --quiet %s" % shlex.quote(revision + "^{commit}")), self.path)
+		return out.decode().strip() if ret == 0 else None
+	def isAncestor(self, ancestor, revision):
+		sargs = self.commandArguments("merge-base --is-ancestor %s %s" % (ancestor, revision))
+		(ret, out, error) = execution.executeCommand(sargs, self.path)
+		if ret > 1:
+			self.commandOutput(sargs, (ret, out, error))
+		return ret == 0
+	@mutation
+	def advance(self, branch):
+		remote = self.getBranchRemote(branch)
+		target = self.resolveRevision("refs/remotes/%s/%s" % (remote, branch))
+		if target is None:
+			raiseError("%s has no %s/%s branch" % (self.path, remote, branch))
+		snapshot = self.querySnapshot()
+		if snapshot.branch not in (branch, "HEAD"):
+			raiseError("%s is on branch %s instead of %s, switch branches manually" % (self.path, snapshot.branch, branch))
+		if snapshot.revision == target and snapshot.branch == branch:
+			return False
+		# local commits that aren't pushed yet: upstream is already there
+		if snapshot.revision != target and self.isAncestor(target, snapshot.revision):
+			return False
+		if not self.isAncestor(snapshot.revision, target):
+			raiseError("%s can't be fast-forwarded to %s/%s" % (self.path, remote, branch))
+		# detached (after an update): back on the local branch, as long as it's behind too
+		local = self.resolveRevision("refs/heads/%s" % branch) if snapshot.branch == "HEAD" else None
+		if local is not None and not self.isAncestor(local, target):
+			raiseError("Local branch %s of %s can't be fast-forwarded to %s/%s" % (branch, self.path, remote, branch))
+		if snapshot.branch == branch or local is not None:
+			if snapshot.branch != branch:
+				self.executeCommand("checkout %s" % shlex.quote(branch))
+			self.executeCommand("merge --ff-only %s" % target)
+		else:
+			self.executeCommand("checkout --track -b %s %s" % (shlex.quote(branch), shlex.quote("%s/%s" % (remote, branch))))
+		return True
+	def watch(self, watcher):
+		key = self.storageKey()
+		gitdir = self.refs.gitDir()
+		if gitdir is None:
+			watcher.unwatched.add(key)
+			return
+		commondir = self.refs.commonDir(gitdir)
+		# the working tree too, edits of tracked files don't touch git's metadata
+		watcher.watchTree(key, self.repositoryKey(), exclude=(".git",))
+		watcher.watch(key, gitdir, ("HEAD", "index", "FETCH_HEAD", "ORIG_HEAD"))
+		watcher.watch(key, os.path.join(gitdir, "info"), ("sparse-checkout",))
+		watcher.watch(key, commondir, ("packed-refs", "config"))
+		watcher.watchTree(key, os.path.join(commondir, "refs"))
+	def updateMirror(self):
+		if GitInterface.mirrors is None or not self.url:
+			return None
+		return GitInterface.mirrors.update(self.url)
+	def getBranchRemote(self, branch):
+		(ret, out, error) = execution.executeCommand(self.commandArguments("config --get %s" % shlex.quote("branch.%s.remote" % branch)), self.path)
+		remote = out.decode().strip() if ret == 0 else ""
+		# '.' means a local branch tracking another local branch
+		return remote if remote not in ("", ".") else "origin"
 	def hasUncommittedChanges(self):
-		out = self.executeCommand("status -s")
-		lines = str.splitlines(out)
-		return len(lines) > 0
+		return self.getSnapshot().dirty
 	def getRemoteChanges(self):
-		up = self.getRevisionCountRange(range="@{u}..")
-		down = self.getRevisionCountRange(range="..@{u}")
-		return (up,down)
+		snapshot = self.getSnapshot()
+		return (snapshot.ahead, snapshot.behind)
+	@query
 	def getRevision(self):
+		revision = self.refs.getRevision()
+		if revision is not None:
+			return revision
+		catfile = self.catFile()
+		if catfile is not None:
+			revision = catfile.resolve("HEAD")
+			if revision is not None:
+				return revision
 		return self.executeCommand("log --pretty=format:'%H' -n 1")
+	@query
+	def hasRevision(self, revision):
+		catfile = self.catFile()
+		if catfile is not None:
+			return catfile.exists(revision + "^{commit}")
+		(ret, out, error) = execution.executeCommand(self.commandArguments("cat-file -e %s^{commit}" % revision), self.path)
+		return ret == 0
+	@revisionQuery
+	def getCommit(self, revision="HEAD"):
+		catfile = self.catFile()
+		if catfile is not None:
+			return catfile.getCommit(revision)
+		out = self.executeCommand("cat-file commit %s" % revision)
+		return Commit.parse(self.executeCommand("rev-parse %s^{commit}" % revision).strip(), out.encode())
+	@query
 	def getRevisionCountRange(self, range): 
 		val = self.executeCommand("rev-list --count %s" % range)
 		return int(val) if val != '' else 0
+	@query
 	def getRevisionCount(self): 
-		return self.getRevisionCountRange(range="HEAD")
+		# Incremental: count(HEAD) = count(A) + count(A..HEAD) for a counted ancestor A,
+		# A..HEAD being exactly the commits not reachable from A, merges included.
+		cache = self.revisionCountCache()
+		if cache is None:
+			return self.getRevisionCountRange(range="HEAD")
+		revision = self.getRevision()
+		count = cache.get(revision)
+		if count is None:
+			ancestor = self.findCountedAncestor(revision, cache)
+			if ancestor is None:
+				count = self.getRevisionCountRange(range=revision)
+			else:
+				count = cache.get(ancestor) + self.getRevisionCountRange(range="%s..%s" % (ancestor, revision))
+			cache.add(revision, count)
+		return count
+	def revisionCountCache(self):
+		gitdir = self.refs.gitDir()
+		if gitdir is None:
+			return None
+		commondir = self.refs.commonDir(gitdir)
+		if os.path.exists(os.path.join(commondir, "shallow")):
+			# counts depend on the (moving) shallow boundary
+			return None
+		return RevisionCountCache(os.path.join(commondir, "glue", "revcounts"))
+	def findCountedAncestor(self, revision, cache):
+		# closest counted commit along the first-parent chain
+		if cache.isEmpty():
+			return None
+		catfile = self.catFile()
+		if catfile is not None:
+			commit = catfile.getCommit(revision)
+			for i in range(ANCESTOR_SEARCH_LIMIT):
+				if commit is None or len(commit.parents) == 0:
+					break
+				if cache.get(commit.parents[0]) is not None:
+					return commit.parents[0]
+				commit = catfile.getCommit(commit.parents[0])
+			return None
+		out = self.executeCommand("rev-list --first-parent --skip=1 --max-count=%d %s" % (ANCESTOR_SEARCH_LIMIT, revision))
+		for ancestor in str.splitlines(out):
+			if cache.get(ancestor) is not None:
+				return ancestor
+		return None
+	@revisionQuery
+	def getDistance(self, left, right):
+		if left == right:
+			return (0, 0)
+		# both sides counted in one walk
+		out = self.executeCommand("rev-list --left-right --count %s...%s" % (left, right))
+		(onlyLeft, onlyRight) = out.split()
+		return (int(onlyLeft), int(onlyRight))
+	@query
+	def getUpstreamRevision(self, branch):
+		return self.resolveRevision("refs/remotes/%s/%s" % (self.getBranchRemote(branch), branch))
+	@query
 	def getDate(self):
+		catfile = self.catFile()
+		if catfile is not None:
+			commit = catfile.getCommit("HEAD")
+			if commit is not None:
+				return commit.getDate()
 		return self.executeCommand("log --pretty=format:'%ci' -n 1")
+	@query
 	def getCurrentBranch(self):
+		b = self.refs.getCurrentBranch()
+		if b is not None:
+			return b
 		b = self.executeCommand("rev-parse --abbrev-ref HEAD")
 		b = b.strip()
 		return b
-	def updateToRevision(self, revision):
-		self.executeCommand("checkout %s" % revision)
+	@query
+	def getSnapshot(self):
+		cache = GitInterface.statusCache
+		if cache is None:
+			return self.querySnapshot()
+		values = cache.lookup(self.path)
+		if values is not None:
+			snapshot = Snapshot.fromDict(values)
+			if cache.safe:
+				snapshot.dirty = self.hasWorkingCopyChanges()
+			return snapshot
+		snapshot = self.querySnapshot()
+		cache.store(self.path, self.refs, snapshot, snapshot.toDict())
+		return snapshot
+	def hasWorkingCopyChanges(self):
+		# no optional locks: leaves the index (and so the status cache fingerprint) untouched
+		out = self.executeCommand("--no-optional-locks status --porcelain")
+		return len(str.splitlines(out)) > 0
+	def querySnapshot(self):
+		out = self.executeCommand("status --porcelain=v2 --branch")
+		revision = None
+		branch = None
+		upstream = None
+		ahead = 0
+		behind = 0
+		dirty = False
+		for line in str.splitlines(out):
+			if not line.startswith("# "):
+				# any changed, unmerged or untracked entry
+				dirty = True
+				continue
+			fields = line.split(" ")
+			if fields[1] == "branch.oid":
+				revision = fields[2] if fields[2] != "(initial)" else None
+			elif fields[1] == "branch.head":
+				# same naming as 'rev-parse --abbrev-ref HEAD'
+				branch = fields[2] if fields[2] != "(detached)" else "HEAD"
+			elif fields[1] == "branch.upstream":
+				upstream = fields[2]
+			elif fields[1] == "branch.ab":
+				ahead = int(fields[2])
+				behind = -int(fields[3])
+		date = self.getDate() if revision is not None else None
+		return Snapshot(revision, branch, date, dirty, upstream, ahead, behind)
+	@mutation
+	def updateToRevision(self, revision, clean=False):
+		if clean:
+			self.executeCommand("checkout --force %s" % revision)
+			self.executeCommand("clean -f -d")
+		else:
+			self.executeCommand("checkout %s" % revision)
 
 class MercurialInterface(VersioningSystemInterface):
-	def __init__(self, path, url):
-		VersioningSystemInterface.__init__(self, path, url)
+	# run commands through a per-repository 'hg serve --cmdserver pipe' (see hgserver.py)
+	useCommandServer = False
+
+	def __init__(self, path, url, sparsePaths=None):
+		VersioningSystemInterface.__init__(self, path, url, sparsePaths)
 		self.executable = HG_BINARY
 		# self.getRevisionCount()
 		# print("rev count: %d" % self.getRevisionCount())
+	def executeCommand(self, args, cwd=None):
+		# the command server runs in the repository, commands elsewhere (clone) can't use it
+		if not MercurialInterface.useCommandServer or cwd is not None:
+			return VersioningSystemInterface.executeCommand(self, args, cwd)
+		server = CommandServer.forRepository(self.executable, self.path)
+		(ret, out, error) = server.runCommand(shlex.split(args))
+		if ret != 0:
+			logging.error("Error %d while executing command 'hg %s'" % (ret, args))
+			raiseError(error)
+		return out
+	def storageKey(self):
+		# 'hg share' repositories point to the shared store
+		hgdir = os.path.join(self.repositoryKey(), ".hg")
+		try:
+			with open(os.path.join(hgdir, "sharedpath"), "r") as f:
+				return os.path.realpath(os.path.join(hgdir, f.read().strip()))
+		except (IOError, OSError):
+			return hgdir
 	def exists(self):
 		return os.path.isdir(os.path.join(self.path, ".hg"))
+	def watch(self, watcher):
+		key = self.storageKey()
+		watcher.watchTree(key, self.repositoryKey(), exclude=(".hg",))
+		watcher.watch(key, os.path.join(self.repositoryKey(), ".hg"), ("dirstate", "bookmarks", "bookmarks.current", "branch"))
+		watcher.watch(key, os.path.join(key, "store"), ("00changelog.i", "phaseroots"))
+	@mutation
+	def fetch(self, branch=None, revisions=()):
+		args = ["pull"]
+		if branch is not None:
+			args += ["--branch", shlex.quote(branch)]
+		for revision in revisions:
+			if not self.hasRevision(revision):
+				args += ["--rev", shlex.quote(revision)]
+		self.executeCommand(" ".join(args))
+	@mutation
+	def clone(self, branch, revision=None, partial=False, depth=None):
+		if partial or depth is not None:
+			logging.warning("Partial & shallow clones aren't supported by Mercurial, cloning %s fully" % (self.url))
+		destination = os.path.realpath(self.path)
+		self.executeCommand("clone --noupdate %s %s" % (shlex.quote(self.url), shlex.quote(destination)), cwd=os.path.dirname(destination))
+		self.executeCommand("update --rev %s" % shlex.quote(revision if revision is not None else branch))
+	def hasRevision(self, revision):
+		try:
+			out = self.executeCommand("log --rev %s --template '{node}'" % shlex.quote(revision))
+		except Exception:
+			return False
+		return out.strip() != ""
+	@query
 	def hasUncommittedChanges(self):
 		out = self.executeCommand("status")
 		lines = str.splitlines(out)
 		return len(lines) > 0
 	# def getRemoteChanges(self):
 	# 	return (0,0)
+	@query
 	def getRevision(self):
 		return self.executeCommand("parent --template '{node}'")
+	@query
 	def getRevisionCount(self): 
 		rev = self.getRevision()
-		lines = self.executeCommand("log -r '0::%s' --template '{node}\n'" % rev)
-		count = lines.count('\n')
-		# print("lines: %d" % lines.count('\n'))
+		cache = RevisionCountCache(os.path.join(self.path, ".hg", "glue", "revcounts"))
+		count = cache.get(rev)
+		if count is None:
+			# counted by hg itself, only the number goes through the pipe
+			out = self.executeCommand("log -r %s --template \"{revset('0::%%s', node)|count}\"" % rev)
+			count = int(out.strip())
+			cache.add(rev, count)
 		return count
+	@revisionQuery
+	def getDistance(self, left, right):
+		if left == right:
+			return (0, 0)
+		counts = []
+		for (a, b) in ((left, right), (right, left)):
+			out = self.executeCommand("log -r %s --template \"{revset('only(%%s, %%s)', '%s', '%s')|count}\"" % (a, a, b))
+			counts.append(int(out.strip()))
+		return tuple(counts)
+	@query
+	def getUpstreamRevision(self, branch):
+		try:
+			out = self.executeCommand("log --rev %s --template '{node}'" % shlex.quote("max(branch('%s'))" % branch))
+		except Exception:
+			return None
+		return out.strip() or None
+	@query
 	def getDate(self):
 		return self.executeCommand("parent --template '{date|isodatesec}'")
+	@query
 	def getCurrentBranch(self):
 		return self.executeCommand("parent --template '{branch}'")
-	def updateToRevision(self, revision):
-		self.executeCommand("update -c --rev %s" % revision)
+	@mutation
+	def advance(self, branch):
+		target = self.executeCommand("log --rev %s --template '{node}'" % shlex.quote("max(branch('%s'))" % branch)).strip()
+		revision = self.executeCommand("parent --template '{node}'").strip()
+		if revision == target:
+			return False
+		ancestor = self.executeCommand("log --rev %s --template '{node}'" % shlex.quote("ancestor(%s, %s)" % (revision, target))).strip()
+		# local commits that aren't pushed yet: upstream is already there
+		if ancestor == target:
+			return False
+		if ancestor != revision:
+			raiseError("%s can't be fast-forwarded to the head of %s" % (self.path, branch))
+		self.executeCommand("update -c --rev %s" % target)
+		return True
+	@mutation
+	def updateToRevision(self, revision, clean=False):
+		if clean:
+			self.executeCommand("update --clean --rev %s" % revision)
+			self.executeCommand("purge --config extensions.purge=")
+		else:
+			self.executeCommand("update -c --rev %s" % revision)
@@ -0,0 +1,120 @@
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import contextlib
+import fcntl
+import hashlib
+import logging
+import os
+import re
+import shlex
+import shutil
+
+from common import *
+from engine import *
+import execution
+
+MIRROR_DIR_ENV = "GLUE_MIRROR_DIR"
+DEFAULT_MIRROR_DIR = os.path.join("~", ".glue", "mirrors")
+
+def defaultMirrorDirectory():
+	return os.path.expanduser(os.environ.get(MIRROR_DIR_ENV, DEFAULT_MIRROR_DIR))
+
+# Machine-wide bare git repositories, one per dependency url, holding every
+# branch of the remote. Dependencies are cloned with --reference to their
+# mirror (objects are then stored once, in the mirror) and fetch from it, so
+# each library is downloaded once per machine whatever the number of projects
+# using it. Clones see the mirror's objects through alternates, so a mirror
+# must never lose objects, even those branches deleted or force-pushed upstream
+# no longer reach: mirrors are created with gc.pruneExpire=never. With
+# dissociate, clones copy the objects they need instead of borrowing them
+# (safer if mirrors get deleted, but no storage sharing).
+class MirrorStore:
+	def __init__(self, executable, directory=None, dissociate=False):
+		self.executable = executable
+		self.directory = directory or defaultMirrorDirectory()
+		self.dissociate = dissociate
+		self.updates = SharedOperations()
+
+	def mirrorPath(self, url):
+		# readable prefix, unique suffix
+		name = re.sub(r"[^A-Za-z0-9._-]+", "_", url.rstrip("/").split("/")[-1])
+		if name.endswith(".git"):
+			name = name[:-4]
+		return os.path.join(self.directory, "%s-%s.git" % (name, hashlib.sha1(url.encode()).hexdigest()[:12]))
+
+	def git(self, args, cwd):
+		sargs = [self.executable] + shlex.split(args)
+		(ret, out, error) = execution.executeCommand(sargs, cwd)
+		if ret != 0:
+			logging.error("Error %d while executing command '%s'" % (ret, " ".join(sargs)))
+			raiseError(error.decode())
+		return out.decode()
+
+	# creates or refreshes the mirror of url (once per run), returns its path.
+	def update(self, url):
+		return self.updates.run(url, lambda: self.updateMirror(url))
+
+	# exclusive access to the mirror of url, other glue processes may use it too.
+	@contextlib.contextmanager
+	def locked(self, url):
+		os.makedirs(self.directory, exist_ok=True)
+		with open(self.mirrorPath(url) + ".lock", "w") as lock:
+			fcntl.flock(lock, fcntl.LOCK_EX)
+			yield
+
+	def hasRevision(self, path, revision):
+		(ret, out, error) = execution.executeCommand([self.executable, "cat-file", "-e", revision + "^{commit}"], path)
+		return ret == 0
+
+	# mirror of url holding revision. Only goes to the network when needed.
+	def mirrorWithRevision(self, url, revision):
+		path = self.mirrorPath(url)
+		if os.path.isdir(path) and self.hasRevision(path, revision):
+			return path
+		self.update(url)
+		if not self.hasRevision(path, revision):
+			# not on any branch (anymore)
+			with self.locked(url):
+				self.git("fetch origin %s" % shlex.quote(revision), path)
+		return path
+
+	def updateMirror(self, url):
+		path = self.mirrorPath(url)
+		with self.locked(url):
+			if not os.path.isdir(path):
+				logging.info("Creating mirror of %s in %s" % (url, path))
+				# built aside, a mirror only shows up once complete
+				temporaryPath = path + ".tmp"
+				shutil.rmtree(temporaryPath, ignore_errors=True)
+				self.git("init --bare --quiet %s" % shlex.quote(temporaryPath), self.directory)
+				self.git("remote add origin %s" % shlex.quote(url), temporaryPath)
+				self.git("config remote.origin.fetch +refs/heads/*:refs/heads/*", temporaryPath)
+				# clones & recorded states may still need unreachable objects
+				self.git("config gc.pruneExpire never", temporaryPath)
+				self.git("fetch --prune origin", temporaryPath)
+				os.rename(temporaryPath, path)
+			else:
+				self.git("fetch --prune origin", path)
+		return path
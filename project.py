@@ -24,24 +24,43 @@
 
 import os
 import logging
+import select
+import time
 import hjson
 
 from common import *
 from dependency import *
+from engine import *
+from configcache import *
 
 GLUEDEPS_FILENAME = ".gluedeps"
 GLUESTATES_FILENAME = ".gluestates"
+GLUECACHE_DIRNAME = os.path.join(".glue", "cache")
+# git operations touch many files in a row, they're reported together
+WATCH_SETTLE_DELAY = 0.1
 
 # Main project, the one holding deps / states files.
 class Project:
-	def __init__(self, path="."):
+	# cache: parsed configuration files are kept in the cache directory
+	def __init__(self, path=".", jobs=None, cache=False):
 		logging.debug("project init")
 		self.path = path
+		self.engine = QueryEngine(jobs)
+		self.configCache = ConfigCache(self.cachePath()) if cache else None
 		self.dependencies = self.loadDeps() # type: list[Dependency]
 
 	def getSortedDependencies(self):
 		return sorted(self.dependencies, key=lambda dep: dep.name.lower())
 
+	# runs query on every dependency concurrently, returns (dep, result) pairs in name order.
+	def queryDependencies(self, query):
+		return self.engine.map(query, self.getSortedDependencies())
+
+	# same, but yields (dep, result) pairs in completion order. Meant for network operations.
+	def streamDependencies(self, operation, deps=None):
+		deps = self.getSortedDependencies() if deps is None else deps
+		return self.engine.imapUnordered(operation, deps, network=True)
+
 	def interface(self):
 		return VersioningSystemInterface.interface(self.path) # no url, not important here
 
@@ -58,8 +77,11 @@ class Project:
 	def gluestatesPath(self):
 		return self.pathForSubpath(GLUESTATES_FILENAME)
 
-	def failIfUncommittedDependencies(self):
-		uncommittedDeps = self.uncommittedDependencies()
+	def cachePath(self):
+		return self.pathForSubpath(GLUECACHE_DIRNAME)
+
+	def failIfUncommittedDependencies(self, snapshots=None):
+		uncommittedDeps = self.uncommittedDependencies(snapshots)
 		if len(uncommittedDeps) > 0:
 			raiseError("Aborting. The following dependencies have uncommitted changes:\n\t%s" % 
 			", ".join(dep.name for dep in uncommittedDeps))
@@ -69,12 +91,12 @@ class Project:
 			raiseError("Aborting. The following dependencies are not valid repositories:\n\t%s" % 
 			", ".join(dep.name for dep in missing))
 	def getStates(self):
-		self.failIfUncommittedDependencies()
+		snapshots = self.snapshots()
+		self.failIfUncommittedDependencies(snapshots)
 		states = {}
 
-		for dep in self.dependencies:
-			state = dep.getState()
-			states[dep.name] = state
+		for dep, snapshot in snapshots:
+			states[dep.name] = dep.getState(snapshot)
 		return states
 
 	def recordDepsStates(self):
@@ -95,18 +117,21 @@ class Project:
 			if dep.name not in states or STATE_REVISION not in states[dep.name]:
 				raiseError("Incorrect/missing state for dependency %s" % (dep.name))
 
-	def loadStates(self):
-		f = open(self.gluestatesPath(), "r")
-		statesString = f.read()
-		logging.info("Reading states: \n%s", statesString)
-		states = hjson.loads(statesString)
+	def loadConfig(self, path):
+		if self.configCache is not None:
+			return self.configCache.load(path, hjson.loads)
+		with open(path, "r") as f:
+			return hjson.loads(f.read())
+
+	def loadStates(self, check=True, path=None):
+		states = self.loadConfig(path or self.gluestatesPath())
 		logging.info("Read states: \n%s", states)
-		f.close()
-		self.checkStates(states)
+		if check:
+			self.checkStates(states)
 		return states
 
 	def loadDeps(self):
-		dicts = hjson.load(open(self.gluedepsPath()))
+		dicts = self.loadConfig(self.gluedepsPath())
 		deps = []
 
 		# logging.debug("loaded deps file: %s" % deps)
@@ -122,24 +147,163 @@ class Project:
 				deps.append(dep)
 		return deps
 
-	def updateDependencies(self, states):
+	# updates dependencies not already at their recorded revision, concurrently.
+	# Returns (dep, (updated, duration)) pairs.
+	def updateDependencies(self, states, clean=False):
 		for dep in self.dependencies:
 			state = states[dep.name]
 			if state == None:
 				raiseError("Missing state for dependency %s" % (dep.name))
-			dep.update(state)
+		# aliases of a working copy are updated once, and must agree on the revision
+		revisions = {}
+		for dep in self.getSortedDependencies():
+			revision = states[dep.name][STATE_REVISION]
+			other = revisions.setdefault(dep.realPath(), (dep, revision))
+			if other[1] != revision:
+				raiseError("Dependencies %s and %s share the same working copy but have different recorded revisions" % (other[0].name, dep.name))
+		updates = SharedOperations()
+		def update(dep):
+			start = time.monotonic()
+			updated = updates.run(dep.realPath(), lambda: dep.update(states[dep.name], clean))
+			return (updated, time.monotonic() - start)
+		return self.queryDependencies(update)
 
-	def fetchDependencies(self):
-		for dep in self.dependencies:
-			dep.fetch()
+	# clones missing dependencies concurrently, returns (dep, (duration, exception or None)) pairs.
+	def bootstrapDependencies(self, states=None, partial=False, depth=None):
+		clones = SharedOperations()
+		def bootstrap(dep):
+			start = time.monotonic()
+			state = states.get(dep.name) if states is not None else None
+			try:
+				clones.run(dep.realPath(), lambda: dep.bootstrap(state, partial, depth))
+			except Exception as e:
+				return (time.monotonic() - start, e)
+			return (time.monotonic() - start, None)
+		missing = self.missingDependencies()
+		return list(self.streamDependencies(bootstrap, sorted(missing, key=lambda dep: dep.name.lower())))
+
+	# puts dependencies at their state revision as worktrees of machine-wide mirrors.
+	# Returns (dep, (updated, duration, exception or None)) pairs.
+	def materializeDependencies(self, states):
+		materializations = SharedOperations()
+		def materialize(dep):
+			start = time.monotonic()
+			try:
+				updated = materializations.run(dep.realPath(), lambda: dep.materialize(states[dep.name]))
+			except Exception as e:
+				return (False, time.monotonic() - start, e)
+			return (updated, time.monotonic() - start, None)
+		return self.queryDependencies(materialize)
 
-	def hasUncommittedDependencies(self):
+	# fetches deps and fast-forwards them to their branch head, concurrently.
+	# Returns (dep, (duration, exception or None, advanced)) pairs.
+	def advanceDependencies(self, deps):
+		advances = SharedOperations()
+		def advance(dep):
+			return advances.run(dep.realPath(), dep.advance)
+		return list(self.streamFetches(advance, deps=sorted(deps, key=lambda dep: dep.name.lower())))
+
+	def hasStates(self):
+		return os.path.exists(self.gluestatesPath())
+
+	def fetchDependencies(self, states=None, deps=None):
+		for dep, (duration, error, result) in self.streamFetches(states=states, deps=deps):
+			if error is not None:
+				raise error
+
+	# revisions of dep that must be available locally, according to states
+	def requiredRevisions(self, dep, states):
+		if states is None or dep.name not in states:
+			return ()
+		return (states[dep.name][STATE_REVISION],)
+
+	# Fetches each distinct repository once, even when several dependencies
+	# (symlinks, worktrees) share it, then runs then(dep). Yields
+	# (dep, (duration, exception or None, result of then)) for every dependency,
+	# as soon as its repository is fetched. With states, recorded revisions are
+	# fetched too.
+	def streamFetches(self, then=None, states=None, deps=None):
+		fetches = SharedOperations()
+		def fetch(dep):
+			start = time.monotonic()
+			revisions = self.requiredRevisions(dep, states)
+			try:
+				fetches.run((dep.storageKey(), dep.branch, revisions), lambda: dep.fetch(revisions))
+				result = then(dep) if then is not None else None
+			except Exception as e:
+				return (time.monotonic() - start, e, None)
+			return (time.monotonic() - start, None, result)
+		return self.streamDependencies(fetch, deps)
+
+	# fetches only dependencies missing their recorded revision, returns them.
+	def fetchMissingRevisions(self, states):
+		def isMissingRevisions(dep):
+			return not all(dep.hasRevision(revision) for revision in self.requiredRevisions(dep, states))
+		missing = [dep for dep, isMissing in self.queryDependencies(isMissingRevisions) if isMissing]
+		if missing:
+			logging.info("Fetching %s" % ", ".join(dep.name for dep in missing))
+			self.fetchDependencies(states, missing)
+		return missing
+
+	# distances between recorded states, HEAD and upstream of every dependency, in name order
+	def drifts(self, states=None):
+		return self.queryDependencies(lambda dep: dep.getDrift(states.get(dep.name) if states is not None else None))
+
+	# watches project files (keyed by the project's real path) and dependencies (see watcher.py)
+	def watch(self, watcher):
+		watcher.watch(self.watchKey(), os.path.realpath(self.path), (GLUEDEPS_FILENAME, GLUESTATES_FILENAME))
 		for dep in self.dependencies:
-			# logging.debug("dep<%s>: uncommitted=%s" % (dep.name, dep.hasUncommittedChanges()))
-			if dep.hasUncommittedChanges():
-				return True
-		return False
-	def uncommittedDependencies(self):
-		return [dep for dep in self.dependencies if dep.hasUncommittedChanges()]
+			if dep.interface is not None:
+				dep.interface.watch(watcher)
+	def watchKey(self):
+		return ("project", os.path.realpath(self.path))
+
+	# Yields (dep, snapshot) for every dependency, then again each time one of
+	# them changes. Only dependencies whose repository changed are queried
+	# again with watcher, everything is every interval seconds without it.
+	# Returns when the project files change.
+	def streamSnapshots(self, watcher=None, interval=1.0):
+		snapshots = {}
+		deps = self.getSortedDependencies()
+		while True:
+			changed = []
+			for dep, snapshot in self.engine.map(Dependency.getSnapshot, deps):
+				if dep not in snapshots or snapshots[dep].toDict() != snapshot.toDict():
+					snapshots[dep] = snapshot
+					changed.append((dep, snapshot))
+			for change in changed:
+				yield change
+			if watcher is None:
+				time.sleep(interval)
+				queryCache.invalidateVolatile()
+				deps = self.getSortedDependencies()
+				continue
+			select.select([watcher.inotify], [], [])
+			time.sleep(WATCH_SETTLE_DELAY)
+			keys = watcher.changes()
+			if keys is None:
+				queryCache.invalidateVolatile()
+				deps = self.getSortedDependencies()
+				continue
+			if self.watchKey() in keys:
+				return
+			for key in keys:
+				queryCache.invalidate(key)
+			deps = [dep for dep in self.getSortedDependencies() if dep.storageKey() in keys]
+
+	def snapshots(self):
+		return self.queryDependencies(Dependency.getSnapshot)
+	def hasUncommittedDependencies(self, snapshots=None):
+		return len(self.uncommittedDependencies(snapshots)) > 0
+	def uncommittedDependencies(self, snapshots=None):
+		if snapshots is None:
+			snapshots = self.snapshots()
+		return [dep for dep, snapshot in snapshots if snapshot.dirty]
+	def dependenciesNamed(self, names):
+		deps = {dep.name: dep for dep in self.dependencies}
+		unknown = [name for name in names if name not in deps]
+		if len(unknown) > 0:
+			raiseError("Unknown dependencies: %s" % ", ".join(unknown))
+		return [deps[name] for name in names]
 	def missingDependencies(self):
 		return [dep for dep in self.dependencies if dep.interface.exists() == False]
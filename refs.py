@@ -0,0 +1,126 @@
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import re
+
+OBJECT_ID = re.compile(r"^([0-9a-f]{40}|[0-9a-f]{64})$")
+SYMREF_PREFIX = "ref: "
+BRANCH_PREFIX = "refs/heads/"
+# refs that belong to a worktree rather than to the shared repository
+WORKTREE_REFS = ("HEAD", "refs/bisect/", "refs/worktree/", "refs/rewritten/")
+MAX_SYMREF_DEPTH = 5
+
+def readFile(path):
+	try:
+		with open(path, "r") as f:
+			return f.read()
+	except (IOError, OSError, UnicodeDecodeError):
+		return None
+
+# Reads refs straight from a git directory, without forking git. Handles
+# symlinked working copies, worktrees & submodules ('.git' files holding a
+# 'gitdir:' pointer), loose refs and packed-refs. Every lookup returns None
+# when something unusual shows up (reftable storage, unborn branch, malformed
+# files...), letting callers fall back to the git binary.
+class GitRefs:
+	def __init__(self, path):
+		self.path = path
+
+	def gitDir(self):
+		dotgit = os.path.join(os.path.realpath(self.path), ".git")
+		if os.path.isdir(dotgit):
+			return dotgit
+		content = readFile(dotgit)
+		if content is None or not content.startswith("gitdir:"):
+			return None
+		gitdir = content[len("gitdir:"):].strip()
+		return os.path.realpath(os.path.join(os.path.dirname(dotgit), gitdir))
+
+	def commonDir(self, gitdir=None):
+		gitdir = gitdir or self.gitDir()
+		if gitdir is None:
+			return None
+		content = readFile(os.path.join(gitdir, "commondir"))
+		if content is None:
+			return gitdir
+		return os.path.realpath(os.path.join(gitdir, content.strip()))
+
+	def packedRefs(self, commondir):
+		refs = {}
+		content = readFile(os.path.join(commondir, "packed-refs"))
+		if content is None:
+			return refs
+		for line in content.splitlines():
+			if line.startswith("#") or line.startswith("^"):
+				continue
+			parts = line.split(" ", 1)
+			if len(parts) == 2:
+				refs[parts[1].strip()] = parts[0]
+		return refs
+
+	# returns (object id, full ref name) for ref, following symbolic refs.
+	# Object id is None for an unborn branch, and the result is None on failure.
+	def resolve(self, ref):
+		gitdir = self.gitDir()
+		if gitdir is None:
+			return None
+		commondir = self.commonDir(gitdir)
+		if os.path.exists(os.path.join(commondir, "reftable")):
+			return None
+		for depth in range(MAX_SYMREF_DEPTH):
+			shared = not ref.startswith(WORKTREE_REFS)
+			content = readFile(os.path.join(commondir if shared else gitdir, ref))
+			if content is None and shared:
+				content = self.packedRefs(commondir).get(ref)
+				if content is None:
+					return (None, ref) if ref.startswith(BRANCH_PREFIX) else None
+			if content is None:
+				return None
+			content = content.strip()
+			if content.startswith(SYMREF_PREFIX):
+				ref = content[len(SYMREF_PREFIX):].strip()
+				continue
+			if OBJECT_ID.match(content) is None:
+				return None
+			return (content, ref)
+		return None
+
+	def getRevision(self):
+		resolved = self.resolve("HEAD")
+		if resolved is None:
+			return None
+		return resolved[0]
+
+	# same naming as 'git rev-parse --abbrev-ref HEAD': branch name, or HEAD when detached.
+	def getCurrentBranch(self):
+		resolved = self.resolve("HEAD")
+		if resolved is None or resolved[0] is None:
+			return None
+		ref = resolved[1]
+		if ref == "HEAD":
+			return ref
+		if ref.startswith(BRANCH_PREFIX):
+			return ref[len(BRANCH_PREFIX):]
+		return None
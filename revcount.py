@@ -0,0 +1,73 @@
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import logging
+import os
+import threading
+
+# Persistent revision -> revision count (number of ancestors, itself included)
+# map of a repository. Counts of a given revision never change, so entries are
+# only ever appended, one "<revision> <count>" line each.
+class RevisionCountCache:
+	def __init__(self, path):
+		self.path = path
+		self.counts = None
+		self.lock = threading.Lock()
+
+	def load(self):
+		if self.counts is not None:
+			return
+		self.counts = {}
+		try:
+			with open(self.path, "r") as f:
+				for line in f:
+					fields = line.split()
+					if len(fields) == 2 and fields[1].isdigit():
+						self.counts[fields[0]] = int(fields[1])
+		except (IOError, OSError):
+			pass
+
+	def get(self, revision):
+		with self.lock:
+			self.load()
+			return self.counts.get(revision)
+
+	def isEmpty(self):
+		with self.lock:
+			self.load()
+			return len(self.counts) == 0
+
+	def add(self, revision, count):
+		with self.lock:
+			self.load()
+			if self.counts.get(revision) == count:
+				return
+			self.counts[revision] = count
+			try:
+				os.makedirs(os.path.dirname(self.path), exist_ok=True)
+				# appending a single short line is atomic, no locking needed between processes
+				with open(self.path, "a") as f:
+					f.write("%s %d\n" % (revision, count))
+			except (IOError, OSError) as e:
+				logging.warning("Could not write revision count cache %s: %s" % (self.path, e))
@@ -0,0 +1,109 @@
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+STATUS_CACHE_DIRNAME = "status"
+
+# stat() signature of a file: changes whenever it's rewritten (git writes files
+# through a lock file + rename, so the inode changes too).
+def fileSignature(path):
+	try:
+		st = os.stat(path)
+	except OSError:
+		return None
+	return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+# writes content to path atomically, concurrent writers can't leave a partial file.
+def writeAtomically(path, content, mode="w"):
+	directory = os.path.dirname(path)
+	os.makedirs(directory, exist_ok=True)
+	(fd, temporaryPath) = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+	try:
+		with os.fdopen(fd, mode) as f:
+			f.write(content)
+		os.replace(temporaryPath, path)
+	except BaseException:
+		try:
+			os.unlink(temporaryPath)
+		except OSError:
+			pass
+		raise
+
+# Persistent repository snapshots (see interface.Snapshot), stored with a
+# fingerprint of the git metadata files they depend on: HEAD, index, config,
+# packed-refs, sparse checkout patterns and the loose refs of the current
+# branch and its upstream. A
+# cached snapshot is returned as long as the fingerprint didn't change.
+#
+# Editing a tracked file doesn't touch any of these files, so in safe mode
+# dirtiness is always re-checked with git, the rest of the snapshot is reused.
+class StatusCache:
+	def __init__(self, directory, safe=False):
+		self.directory = os.path.join(directory, STATUS_CACHE_DIRNAME)
+		self.safe = safe
+
+	def entryPath(self, repository):
+		key = hashlib.sha1(os.path.realpath(repository).encode()).hexdigest()
+		return os.path.join(self.directory, key + ".json")
+
+	def fingerprint(self, refs, snapshot):
+		gitdir = refs.gitDir()
+		if gitdir is None:
+			return None
+		commondir = refs.commonDir(gitdir)
+		paths = [os.path.join(gitdir, "HEAD"), os.path.join(gitdir, "index"), os.path.join(commondir, "config"), os.path.join(commondir, "packed-refs"), os.path.join(gitdir, "info", "sparse-checkout")]
+		if snapshot.branch is not None and snapshot.branch != "HEAD":
+			paths.append(os.path.join(commondir, "refs", "heads", snapshot.branch))
+		if snapshot.upstream is not None:
+			paths.append(os.path.join(commondir, "refs", "remotes", snapshot.upstream))
+		return [[path, fileSignature(path)] for path in paths]
+
+	# returns the cached snapshot dictionary, or None when missing or stale.
+	def lookup(self, repository):
+		try:
+			with open(self.entryPath(repository), "r") as f:
+				entry = json.load(f)
+		except (IOError, OSError, ValueError):
+			return None
+		fingerprint = entry.get("fingerprint")
+		if not fingerprint:
+			return None
+		if [[path, fileSignature(path)] for path, signature in fingerprint] != fingerprint:
+			logging.debug("status cache: %s changed" % repository)
+			return None
+		return entry.get("snapshot")
+
+	def store(self, repository, refs, snapshot, values):
+		fingerprint = self.fingerprint(refs, snapshot)
+		if fingerprint is None:
+			return
+		try:
+			writeAtomically(self.entryPath(repository), json.dumps({"repository": os.path.realpath(repository), "fingerprint": fingerprint, "snapshot": values}))
+		except (IOError, OSError) as e:
+			logging.warning("Could not write status cache for %s: %s" % (repository, e))
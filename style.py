@@ -40,6 +40,7 @@ class Style:
 	UNDERLINE = '\033[4m'
 
 	ENDC = '\033[0m'
+	CLEARLINE = '\033[K'
 
 
 def tagged(text, tag):
@@ -68,3 +69,17 @@ def revision(text):
 	return tagged(text, Style.ITALIC)
 def branch(text):
 	return tagged(text, Style.BOLD)
+
+# Single line of progress, rewritten in place. Only shown on terminals.
+class ProgressLine:
+	def __init__(self, stream):
+		self.stream = stream
+		self.enabled = stream.isatty()
+	def update(self, text):
+		if self.enabled:
+			self.stream.write("\r" + Style.CLEARLINE + text)
+			self.stream.flush()
+	def clear(self):
+		if self.enabled:
+			self.stream.write("\r" + Style.CLEARLINE)
+			self.stream.flush()
@@ -0,0 +1,98 @@
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import interface
+
+HG = shutil.which("hg")
+ENVIRONMENT = dict(os.environ, GIT_AUTHOR_NAME="glue", GIT_AUTHOR_EMAIL="glue@example.com", GIT_COMMITTER_NAME="glue", GIT_COMMITTER_EMAIL="glue@example.com", HGUSER="glue <glue@example.com>", HGPLAIN="1")
+
+def run(args, cwd):
+	return subprocess.run(args, cwd=cwd, env=ENVIRONMENT, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).stdout.decode().strip()
+
+def git(args, cwd):
+	return run([interface.GIT_BINARY] + args, cwd)
+
+def hg(args, cwd):
+	return run([HG] + args, cwd)
+
+# Runs each test from its own temporary directory, with empty query caches.
+class ProjectTestCase(unittest.TestCase):
+	def setUp(self):
+		self.directory = os.path.realpath(tempfile.mkdtemp())
+		self.addCleanup(shutil.rmtree, self.directory)
+		cwd = os.getcwd()
+		os.chdir(self.directory)
+		self.addCleanup(os.chdir, cwd)
+		if HG is not None:
+			binary = interface.HG_BINARY
+			interface.HG_BINARY = HG
+			self.addCleanup(setattr, interface, "HG_BINARY", binary)
+		self.addCleanup(setattr, interface.MercurialInterface, "useCommandServer", False)
+		interface.queryCache.invalidate()
+
+	# commits new content of 'file' in source, returns the new revision
+	def commitGit(self, source, content):
+		with open(os.path.join(source, "file"), "w") as f:
+			f.write(content)
+		git(["add", "file"], source)
+		git(["commit", "-q", "-m", content], source)
+		return git(["rev-parse", "HEAD"], source)
+
+	def commitHg(self, source, content):
+		with open(os.path.join(source, "file"), "w") as f:
+			f.write(content)
+		hg(["commit", "-q", "-A", "-m", content], source)
+		return hg(["log", "-r", ".", "--template", "{node}"], source)
+
+	# returns (source working copy, bare repository, [revisions])
+	def makeGitRepository(self, name, commits=2):
+		source = os.path.join(self.directory, "sources", name)
+		os.makedirs(source)
+		git(["init", "-q", "-b", "master"], source)
+		revisions = [self.commitGit(source, "%d\n" % i) for i in range(commits)]
+		bare = os.path.join(self.directory, "remotes", name + ".git")
+		git(["clone", "-q", "--bare", source, bare], self.directory)
+		git(["remote", "add", "origin", bare], source)
+		return (source, bare, revisions)
+
+	# returns (source working copy, repository without working copy, [revisions])
+	def makeHgRepository(self, name, commits=2):
+		source = os.path.join(self.directory, "sources", name)
+		os.makedirs(source)
+		hg(["init"], source)
+		revisions = [self.commitHg(source, "%d\n" % i) for i in range(commits)]
+		bare = os.path.join(self.directory, "remotes", name)
+		hg(["clone", "-q", "--noupdate", source, bare], self.directory)
+		return (source, bare, revisions)
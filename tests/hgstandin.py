@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# Scripted stand-in for 'hg serve --cmdserver pipe' (see hgserver.py), speaking
+# the command server protocol without needing Mercurial:
+#	log ...         output on 'o', debug noise on 'd', result 0
+#	fail ...        error on 'e', result 255
+#	prompt          asks for input on 'L', errors out unless it gets end of input
+#	unsupported     sends a required channel glue doesn't know
+# $STANDIN_GREETING replaces the greeting.
+
+import os
+import struct
+import sys
+
+output = sys.stdout.buffer
+input = sys.stdin.buffer
+
+def send(channel, data):
+	output.write(channel + struct.pack(">I", len(data)) + data)
+	output.flush()
+
+def result(code):
+	send(b'r', struct.pack(">i", code))
+
+if sys.argv[1:] != ["serve", "--cmdserver", "pipe"]:
+	sys.exit("unexpected arguments: %s" % sys.argv[1:])
+send(b'o', os.environ.get("STANDIN_GREETING", "capabilities: getencoding runcommand\nencoding: UTF-8\npid: %d" % os.getpid()).encode())
+
+while True:
+	line = input.readline()
+	if not line:
+		break
+	if line != b'runcommand\n':
+		sys.exit("unexpected command: %r" % line)
+	(length,) = struct.unpack(">I", input.read(4))
+	args = [arg.decode() for arg in input.read(length).split(b'\0')]
+	if args[0] == "log":
+		send(b'd', b'debug output, ignored')
+		send(b'o', " ".join(args[1:]).encode())
+		send(b'o', "\nénd".encode())
+		result(0)
+	elif args[0] == "fail":
+		send(b'e', b'abort: failing on purpose\n')
+		result(255)
+	elif args[0] == "prompt":
+		output.write(b'L' + struct.pack(">I", 4096))
+		output.flush()
+		(length,) = struct.unpack(">I", input.read(4))
+		if length != 0:
+			send(b'e', b'got input\n')
+			result(1)
+		else:
+			send(b'o', b'no input')
+			result(0)
+	elif args[0] == "unsupported":
+		send(b'X', b'')
+	else:
+		send(b'e', ("unknown command %s\n" % args[0]).encode())
+		result(255)
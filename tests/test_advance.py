@@ -0,0 +1,92 @@
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+
+import os
+import unittest
+
+from helpers import HG, ProjectTestCase, git, hg
+from project import Project
+
+# Fast-forwards of dependencies behind, ahead of and diverged from their upstream.
+class AdvanceTest(ProjectTestCase):
+	def makeProject(self, type, branch, url):
+		with open(".gluedeps", "w") as f:
+			f.write("lib: {\n\tpath: libs/lib\n\ttype: %s\n\tbranch: %s\n\turl: \"%s\"\n}\n" % (type, branch, url))
+		project = Project()
+		[(dep, (duration, error))] = project.bootstrapDependencies(None)
+		self.assertIsNone(error)
+		return (project, dep)
+
+	# returns (dep, error, whether the working copy was touched)
+	def advance(self, project):
+		[(dep, (duration, error, advanced))] = project.advanceDependencies(project.dependencies)
+		return (dep, error, advanced)
+
+	def checkAdvance(self, project, dep, commitUpstream, commitLocally):
+		# behind
+		head = commitUpstream("upstream 1\n")
+		(dep, error, advanced) = self.advance(project)
+		self.assertIsNone(error)
+		self.assertTrue(advanced)
+		self.assertEqual(dep.getRevision(), head)
+		(dep, error, advanced) = self.advance(project)
+		self.assertIsNone(error)
+		self.assertFalse(advanced)
+
+		# ahead: nothing to do
+		local = commitLocally("local 1\n")
+		(dep, error, advanced) = self.advance(project)
+		self.assertIsNone(error)
+		self.assertFalse(advanced)
+		self.assertEqual(dep.getRevision(), local)
+
+		# diverged
+		commitUpstream("upstream 2\n")
+		(dep, error, advanced) = self.advance(project)
+		self.assertIn("can't be fast-forwarded", error.message)
+		self.assertEqual(dep.getRevision(), local)
+
+	def testGit(self):
+		(source, url, revisions) = self.makeGitRepository("lib")
+		(project, dep) = self.makeProject("git", "master", url)
+		def commitUpstream(content):
+			revision = self.commitGit(source, content)
+			git(["push", "-q", "origin", "master"], source)
+			return revision
+		self.checkAdvance(project, dep, commitUpstream, lambda content: self.commitGit(os.path.join(self.directory, "libs", "lib"), content))
+
+	@unittest.skipUnless(HG, "hg isn't installed")
+	def testMercurial(self):
+		(source, url, revisions) = self.makeHgRepository("lib")
+		(project, dep) = self.makeProject("hg", "default", url)
+		def commitUpstream(content):
+			revision = self.commitHg(source, content)
+			hg(["push", "-q", url], source)
+			return revision
+		self.checkAdvance(project, dep, commitUpstream, lambda content: self.commitHg(os.path.join(self.directory, "libs", "lib"), content))
+
+if __name__ == '__main__':
+	unittest.main()
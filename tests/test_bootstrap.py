@@ -0,0 +1,74 @@
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import unittest
+
+from helpers import HG, ProjectTestCase
+import interface
+from project import Project
+
+# Bootstraps a project whose dependencies come from local bare repositories.
+@unittest.skipUnless(HG, "hg isn't installed")
+class BootstrapTest(ProjectTestCase):
+	def makeProject(self, states):
+		(source, gitUrl, self.gitRevisions) = self.makeGitRepository("gitlib")
+		(source, hgUrl, self.hgRevisions) = self.makeHgRepository("hglib")
+		with open(".gluedeps", "w") as f:
+			f.write("gitlib: {\n\tpath: libs/gitlib\n\ttype: git\n\tbranch: master\n\turl: \"%s\"\n}\n" % gitUrl)
+			f.write("hglib: {\n\tpath: libs/hglib\n\ttype: hg\n\tbranch: default\n\turl: \"%s\"\n}\n" % hgUrl)
+		if states:
+			with open(".gluestates", "w") as f:
+				f.write("gitlib: {\n\trevision: %s\n}\n" % self.gitRevisions[0])
+				f.write("hglib: {\n\trevision: %s\n}\n" % self.hgRevisions[0])
+		return Project()
+
+	def bootstrap(self, project):
+		states = project.loadStates(check=False) if project.hasStates() else None
+		results = project.bootstrapDependencies(states)
+		self.assertEqual(sorted(dep.name for dep, result in results), ["gitlib", "hglib"])
+		for dep, (duration, error) in results:
+			self.assertIsNone(error, "%s: %s" % (dep.name, error))
+		self.assertEqual(project.missingDependencies(), [])
+		return dict((dep.name, dep) for dep in project.dependencies)
+
+	def testBootstrapAtRecordedStates(self):
+		deps = self.bootstrap(self.makeProject(states=True))
+		self.assertEqual(deps["gitlib"].getRevision(), self.gitRevisions[0])
+		self.assertEqual(deps["hglib"].getRevision(), self.hgRevisions[0])
+		self.assertFalse(deps["hglib"].hasUncommittedChanges())
+
+	def testBootstrapBranchHeads(self):
+		deps = self.bootstrap(self.makeProject(states=False))
+		self.assertEqual(deps["gitlib"].getRevision(), self.gitRevisions[-1])
+		self.assertEqual(deps["hglib"].getRevision(), self.hgRevisions[-1])
+
+	def testBootstrapThroughCommandServer(self):
+		interface.MercurialInterface.useCommandServer = True
+		deps = self.bootstrap(self.makeProject(states=True))
+		self.assertEqual(deps["hglib"].getRevision(), self.hgRevisions[0])
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,75 @@
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hjson
+from configcache import ConfigCache
+
+class ConfigCacheTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.directory)
+		self.cache = ConfigCache(os.path.join(self.directory, "cache"))
+		self.path = os.path.join(self.directory, ".gluedeps")
+		self.write("lib: {\n\tpath: lib\n\ttype: git\n}\n")
+		self.parses = 0
+
+	def write(self, content):
+		with open(self.path, "w") as f:
+			f.write(content)
+
+	def parse(self, text):
+		self.parses += 1
+		return hjson.loads(text)
+
+	def testReusesParsedValue(self):
+		first = self.cache.load(self.path, self.parse)
+		second = self.cache.load(self.path, self.parse)
+		self.assertEqual(self.parses, 1)
+		self.assertEqual(first, second)
+		self.assertEqual(list(second["lib"].keys()), ["path", "type"])
+
+	def testParsesChangedFile(self):
+		self.cache.load(self.path, self.parse)
+		self.write("lib: {\n\tpath: other\n\ttype: git\n}\n")
+		self.assertEqual(self.cache.load(self.path, self.parse)["lib"]["path"], "other")
+		self.assertEqual(self.parses, 2)
+
+	def testIgnoresGarbageEntry(self):
+		os.makedirs(os.path.dirname(self.cache.entryPath(self.path)))
+		with open(self.cache.entryPath(self.path), "wb") as f:
+			f.write(b"\x80\x04not json")
+		self.assertEqual(self.cache.load(self.path, self.parse)["lib"]["path"], "lib")
+		self.assertEqual(self.parses, 1)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,70 @@
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import daemon
+
+class SocketDirectoryTest(unittest.TestCase):
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		self.addCleanup(shutil.rmtree, self.directory)
+
+	def testPrivateDirectory(self):
+		os.chmod(self.directory, 0o700)
+		self.assertIsNone(daemon.socketDirectoryProblem(self.directory))
+
+	def testDirectoryOpenToOthers(self):
+		os.chmod(self.directory, 0o755)
+		self.assertIsNotNone(daemon.socketDirectoryProblem(self.directory))
+
+	def testSymlink(self):
+		link = os.path.join(self.directory, "link")
+		os.symlink(self.directory, link)
+		self.assertIsNotNone(daemon.socketDirectoryProblem(link))
+
+	def testUnsafeSocketIsIgnored(self):
+		os.chmod(self.directory, 0o777)
+		previous = os.environ.get(daemon.DAEMON_DIR_ENV)
+		os.environ[daemon.DAEMON_DIR_ENV] = self.directory
+		try:
+			path = daemon.socketPath(".")
+			open(path, "w").close()
+			self.assertIsNone(daemon.connect("."))
+			self.assertIsNone(daemon.forward(["glue", "check"]))
+		finally:
+			if previous is None:
+				del os.environ[daemon.DAEMON_DIR_ENV]
+			else:
+				os.environ[daemon.DAEMON_DIR_ENV] = previous
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,87 @@
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import execution
+
+class CommandExecutorTest(unittest.TestCase):
+	def tearDown(self):
+		execution.configureExecution()
+
+	# runs commands concurrently, returns their results (or error messages)
+	def runConcurrently(self, commands):
+		results = [None] * len(commands)
+		def run(index):
+			try:
+				results[index] = execution.executeCommand(commands[index], "/")[0]
+			except Exception as e:
+				results[index] = getattr(e, "message", str(e))
+		threads = [threading.Thread(target=run, args=(index,)) for index in range(len(commands))]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		return results
+
+	def testTimeoutExcludesQueueing(self):
+		execution.configureExecution(concurrency=1, timeout=1.5)
+		self.assertEqual(self.runConcurrently([["sleep", "1"]] * 3), [0, 0, 0])
+
+	def testTimeout(self):
+		execution.configureExecution(timeout=0.5)
+		start = time.monotonic()
+		self.assertIn("timed out", self.runConcurrently([["sleep", "5"]])[0])
+		self.assertLess(time.monotonic() - start, 4)
+
+	def testDeadlineIncludesQueueing(self):
+		execution.configureExecution(concurrency=1, deadline=1.5)
+		results = self.runConcurrently([["sleep", "1"]] * 3)
+		self.assertEqual(results.count(0), 1)
+		self.assertEqual(len([result for result in results if "deadline" in str(result)]), 2)
+
+	def testLoopFailureIsRaised(self):
+		executor = execution.CommandExecutor(concurrency=-1)
+		self.assertRaises(ValueError, executor.startLoop)
+		self.assertIsNone(executor.loop)
+
+	@unittest.skipUnless(os.path.isdir("/proc/self/fd"), "needs /proc")
+	def testReconfiguringClosesLoops(self):
+		execution.configureExecution()
+		execution.executeCommand(["true"], "/")
+		descriptors = len(os.listdir("/proc/self/fd"))
+		for i in range(10):
+			execution.configureExecution()
+			execution.executeCommand(["true"], "/")
+		self.assertEqual(len(os.listdir("/proc/self/fd")), descriptors)
+
+if __name__ == '__main__':
+	unittest.main()
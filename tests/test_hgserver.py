@@ -0,0 +1,81 @@
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from hgserver import CommandServer
+
+STANDIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hgstandin.py")
+
+# CommandServer against a scripted stand-in server (see hgstandin.py)
+class CommandServerTest(unittest.TestCase):
+	def setUp(self):
+		self.server = CommandServer(STANDIN, os.path.dirname(STANDIN))
+		self.addCleanup(self.server.close)
+
+	def testOutputAndResult(self):
+		(ret, out, error) = self.server.runCommand(["log", "-r", "."])
+		self.assertEqual((ret, out, error), (0, "-r .\nénd", ""))
+
+	def testNonZeroResult(self):
+		(ret, out, error) = self.server.runCommand(["fail"])
+		self.assertEqual(ret, 255)
+		self.assertEqual(error, "abort: failing on purpose\n")
+
+	def testInputRequestGetsEndOfInput(self):
+		self.assertEqual(self.server.runCommand(["prompt"]), (0, "no input", ""))
+
+	def testServerIsReused(self):
+		self.server.runCommand(["log"])
+		process = self.server.process
+		self.assertEqual(self.server.runCommand(["fail"])[0], 255)
+		self.assertEqual(self.server.runCommand(["log", "again"])[1], "again\nénd")
+		self.assertIs(self.server.process, process)
+
+	def testUnsupportedRequiredChannel(self):
+		with self.assertRaises(Exception):
+			self.server.runCommand(["unsupported"])
+		self.assertIsNone(self.server.process)
+		# restarted on next use
+		self.assertEqual(self.server.runCommand(["log"])[0], 0)
+
+	def testUnexpectedGreeting(self):
+		os.environ["STANDIN_GREETING"] = "capabilities: getencoding"
+		try:
+			with self.assertRaises(Exception):
+				self.server.runCommand(["log"])
+		finally:
+			del os.environ["STANDIN_GREETING"]
+
+	def testForRepository(self):
+		self.assertIs(CommandServer.forRepository(STANDIN, "."), CommandServer.forRepository(STANDIN, os.path.abspath(".")))
+		CommandServer.closeAll()
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,102 @@
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import unittest
+
+from helpers import ProjectTestCase, git
+import interface
+from project import Project
+
+# Sparse checkouts following the 'paths' declared in .gluedeps.
+class SparseCheckoutTest(ProjectTestCase):
+	def setUp(self):
+		ProjectTestCase.setUp(self)
+		source = os.path.join(self.directory, "source")
+		for directory in ("a", "b", "c/d"):
+			os.makedirs(os.path.join(source, directory))
+			with open(os.path.join(source, directory, "file"), "w") as f:
+				f.write(directory)
+		git(["init", "-q", "-b", "master"], source)
+		git(["add", "-A"], source)
+		git(["commit", "-q", "-m", "initial"], source)
+		self.url = "file://" + source
+		self.revision = git(["rev-parse", "HEAD"], source)
+		with open(".gluestates", "w") as f:
+			f.write("lib: {\n\trevision: %s\n}\n" % self.revision)
+
+	def project(self, paths):
+		interface.queryCache.invalidate()
+		with open(".gluedeps", "w") as f:
+			f.write("lib: {\n\tpath: lib\n\ttype: git\n\tbranch: master\n\turl: \"%s\"\n" % self.url)
+			if paths is not None:
+				f.write("\tpaths: [%s]\n" % ", ".join('"%s"' % path for path in paths))
+			f.write("}\n")
+		return Project()
+
+	def checkedOut(self):
+		return sorted(entry for entry in os.listdir("lib") if entry != ".git")
+
+	def update(self, project):
+		[(dep, (updated, duration))] = project.updateDependencies(project.loadStates())
+		return updated
+
+	def testPathsFollowDeclaration(self):
+		project = self.project(["a", "c/d"])
+		[(dep, (duration, error))] = project.bootstrapDependencies(project.loadStates())
+		self.assertIsNone(error)
+		self.assertEqual(self.checkedOut(), ["a", "c"])
+		self.assertFalse(project.hasUncommittedDependencies())
+
+		project = self.project(["c/d"])
+		self.assertTrue(self.update(project))
+		self.assertEqual(self.checkedOut(), ["c"])
+		self.assertFalse(self.update(project))
+
+		# no more paths: everything again
+		project = self.project(None)
+		self.assertTrue(self.update(project))
+		self.assertEqual(self.checkedOut(), ["a", "b", "c"])
+		self.assertFalse(self.update(project))
+		self.assertFalse(project.hasUncommittedDependencies())
+
+	def testUnchangedPathsKeepCachedQueries(self):
+		project = self.project(["a"])
+		[(dep, (duration, error))] = project.bootstrapDependencies(project.loadStates())
+		self.assertIsNone(error)
+		snapshots = []
+		querySnapshot = interface.GitInterface.querySnapshot
+		def countingQuerySnapshot(repository):
+			snapshots.append(repository.path)
+			return querySnapshot(repository)
+		interface.GitInterface.querySnapshot = countingQuerySnapshot
+		self.addCleanup(setattr, interface.GitInterface, "querySnapshot", querySnapshot)
+		project = self.project(["a"])
+		self.assertFalse(project.hasUncommittedDependencies())
+		self.assertFalse(self.update(project))
+		self.assertEqual(len(snapshots), 1)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,159 @@
+# Copyright (c) 2017-2019 Creaceed SPRL and other Glue contributors.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of Creaceed SPRL nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL CREACEED SPRL BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import struct
+
+# see inotify(7)
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# anything that can change a file's content or a directory's entries
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+EVENT_HEADER = struct.Struct("iIII") # wd, mask, cookie, name length
+
+# Raw inotify instance, through libc (Linux only, OSError elsewhere).
+class Inotify:
+	def __init__(self):
+		self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+		if not hasattr(self.libc, "inotify_init1"):
+			raise OSError(errno.ENOSYS, "inotify isn't available")
+		self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if self.fd < 0:
+			raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+
+	def fileno(self):
+		return self.fd
+
+	def addWatch(self, path, mask):
+		wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+		if wd < 0:
+			raise OSError(ctypes.get_errno(), "%s: %s" % (os.strerror(ctypes.get_errno()), path))
+		return wd
+
+	# pending (wd, mask, name) events, without blocking
+	def readEvents(self):
+		events = []
+		while True:
+			try:
+				buffer = os.read(self.fd, 64 * 1024)
+			except BlockingIOError:
+				return events
+			offset = 0
+			while offset < len(buffer):
+				(wd, mask, cookie, length) = EVENT_HEADER.unpack_from(buffer, offset)
+				offset += EVENT_HEADER.size
+				name = buffer[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+				offset += length
+				events.append((wd, mask, name))
+
+	def close(self):
+		os.close(self.fd)
+
+# Directories watched on behalf of keys (typically repositories). Git replaces
+# files through a lock file + rename, so files are watched through their
+# directory, filtered by name. changes() returns the keys touched since its
+# last call.
+class Watcher:
+	def __init__(self):
+		self.inotify = Inotify()
+		self.watches = {} # wd -> (keys, directory, names or None for a tree, excluded names)
+		self.unwatched = set() # keys some watch couldn't be set up for, always considered changed
+
+	def watch(self, key, directory, names=None, exclude=()):
+		try:
+			wd = self.inotify.addWatch(directory, WATCH_MASK)
+		except OSError as e:
+			# missing directory, or out of watches (fs.inotify.max_user_watches)
+			logging.debug("watcher: can't watch %s: %s" % (directory, e))
+			self.unwatched.add(key)
+			return
+		keys = {key}
+		names = set(names) if names is not None else None
+		exclude = set(exclude)
+		if wd in self.watches:
+			# same directory watched again (by another key, or for other names)
+			(otherKeys, otherDirectory, otherNames, otherExclude) = self.watches[wd]
+			keys |= otherKeys
+			names = otherNames | names if otherNames is not None and names is not None else None
+			exclude &= otherExclude
+		self.watches[wd] = (keys, directory, names, exclude)
+
+	# the directory, its files and all subdirectories, new ones included
+	def watchTree(self, key, directory, exclude=()):
+		self.watch(key, directory, None, exclude)
+		try:
+			entries = os.scandir(directory)
+		except OSError:
+			return
+		with entries:
+			for entry in entries:
+				if entry.name not in exclude and entry.is_dir(follow_symlinks=False):
+					self.watchTree(key, entry.path)
+
+	# None when events were lost: anything may have changed
+	def changes(self):
+		changed = set(self.unwatched)
+		for wd, mask, name in self.inotify.readEvents():
+			if mask & IN_Q_OVERFLOW:
+				return None
+			watch = self.watches.get(wd)
+			if watch is None:
+				continue
+			(keys, directory, names, exclude) = watch
+			if mask & IN_IGNORED:
+				# directory gone
+				del self.watches[wd]
+				changed |= keys
+				continue
+			if names is not None and name not in names:
+				continue
+			if names is None and name in exclude:
+				continue
+			changed |= keys
+			if names is None and mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+				for key in keys:
+					self.watchTree(key, os.path.join(directory, name))
+		return changed
+
+	def close(self):
+		self.inotify.close()